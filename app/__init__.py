@@ -1,25 +1,81 @@
-import socket, sys, time, logging
+import socket, sys, time, json, random, logging, threading
+from concurrent.futures import ThreadPoolExecutor
 from .service import RpiNode, DiscoverCatcher
-from .models import Rc, Node
+from .stream import SocketWriter
 from .drivers import ArduinoDriver
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from .dispatcher import EventDispatcher
+from .routing import RoutingTable
+from .config import load_node_config, load_snapshot, save_snapshot, ConfigValidator
+from .database import Database
+from .telemetry import TelemetryBatcher
+from .protocol import encode_message
+from .irsession import IrSession
+from app import helper
 
 class App():
     host = None
     port = 32001
     ads = {}
     db_uri = None
+    event_workers = 4
+    event_queue_size = 256
+    # Chunks in flight per Arduino usb port, others use stop-and-wait
+    serial_windows = {}
+    telemetry_interval = 0.5
+    telemetry_batch_size = 32
+    # Offered to the server in the handshake: batch, bin, ir_frames, typed.
+    # Only set them for servers that take host:handshake:<features>, others get host:handshake
+    features = []
+    capabilities = set()
+    db = None
+    config = None
+    snapshot_path = 'node.snapshot.json'
+    db_pool_size = 5
+    db_max_overflow = 5
+    db_pool_recycle = 3600
+    db_pool_pre_ping = True
+    # Direct reconnects to the last server before going back to discovery
+    reconnect_attempts = 6
+    reconnect_min_delay = 0.05
+    reconnect_max_delay = 2
+    connect_timeout = 3
+    # Sessions shorter than this back off like failed connects, a longer one resets the backoff
+    session_min_time = 10
+    # Seconds to flush telemetry and queued frames to the server on exit
+    shutdown_timeout = 2
+    # Arduino ports opened at the same time
+    port_workers = 8
+    # Send decoded IR buttons as protocol codes, needs an Arduino sketch that encodes them
+    ir_codes = False
+    # Send other IR buttons bit packed instead of as text, same sketch caveat
+    ir_packed = False
+    # Presses of the same key averaged into one IR signal, servers with ir_frames ask for more per catchIr
+    ir_frames = 1
 
     def __init__(self):
         self.catcher = DiscoverCatcher()
         self.host_name = socket.gethostname()
+        self.db_lock = threading.Lock()
+        self.routing = RoutingTable()
+        self.config_lock = threading.Lock()
+        # usb -> opening, ready or failed
+        self.port_status = {}
+        # usb -> token of the bring-up in progress, a stop or a newer config voids it
+        self.port_openings = {}
+        self.port_pool = ThreadPoolExecutor(max_workers=self.port_workers)
+        self.short_sessions = 0
+        self.ir_session = None
 
     def createSession(self):
-        engine = create_engine(self.db_uri)
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        return session
+        with self.db_lock:
+            if self.db is None:
+                self.db = Database(self.db_uri,
+                    pool_size=self.db_pool_size,
+                    max_overflow=self.db_max_overflow,
+                    pool_recycle=self.db_pool_recycle,
+                    pool_pre_ping=self.db_pool_pre_ping)
+
+        return self.db.createSession()
 
     def run(self, debug = False):
         logging.basicConfig(
@@ -35,72 +91,303 @@ class App():
         self.interrupt = False
         self.status = 'stopped'
         self.createDbUri()
+        self.dispatcher = EventDispatcher(self.event_workers, self.event_queue_size)
+        self.writer = SocketWriter()
+        self.writer.setDaemon(True)
+        self.writer.start()
+        self.telemetry = TelemetryBatcher(self, self.telemetry_interval, self.telemetry_batch_size)
+        self.telemetry.setDaemon(True)
+        self.telemetry.start()
 
         while True:
-            self.host = self.catcher.catchIP()
-            
-            if self.host is not None:
-                self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
-
-                try:
-                    self.sock.connect((self.host, self.port))
-                    logging.info('Handshake with the server')
-                    request = "%s:%s\n" % (socket.gethostname(), 'handshake')
-                    self.sock.send(request.encode())
-
-                    # Wait for handshake
-                    data = self.sock.recv(1024)
-
-                    if data:
-                        udata = data.decode()
-
-                        if udata != 'accept':
-                            logging.warning('Did not accept')
-                            self.sock.close()
-                            continue
-                        else:
-                            logging.info('Accepted')
-                    else:
-                        logging.warning('Empty response')
-                        self.sock.close()
-                        continue
-                
-                except Exception as e:
-                    logging.exception('The server closed the connection')
-                    for arduino in self.ads:
-                        self.ads[arduino].close()
-                    self.sock.close()
+            # The last server first, discovery only when it stays away
+            if self.host is None or not self.reconnect():
+                self.host = self.catcher.catchIP()
+
+                if self.host is None or not self.connectServer(self.host):
                     continue
 
-                node = RpiNode(self)
-                node.run()
+            self.writer.attach(self.sock)
+            started_at = time.time()
+            node = RpiNode(self)
+            node.run()
+
+            if self.interrupt == True:
+                self.closeArduinoDrivers()
+                self.closeStreams()
+                self.sock.close()
+                break
+
+            self.writer.detach()
+
+            # A server that accepts and drops at once, or a node missing in DB, must not spin
+            if time.time() - started_at >= self.session_min_time:
+                self.short_sessions = 0
+            else:
+                self.short_sessions += 1
+                logging.warning('Session ended after %.1f s, back off' % (time.time() - started_at))
+                self.backoff(self.short_sessions)
+
+    def closeStreams(self):
+        # Pending telemetry goes to the writer, then the writer sends what is queued
+        deadline = time.time() + self.shutdown_timeout
+        self.telemetry.stop()
+        self.telemetry.join(max(deadline - time.time(), 0))
+
+        if not self.writer.drain(max(deadline - time.time(), 0)):
+            logging.warning('Could not send every queued frame before exit')
+
+        self.writer.stop()
+        self.writer.join(max(deadline - time.time(), 0))
+
+    def reconnect(self):
+        # Jittered exponential backoff, the first attempt goes right away
+        for attempt in range(self.reconnect_attempts):
+            if attempt > 0:
+                self.backoff(attempt)
+
+            started_at = time.time()
+
+            if self.connectServer(self.host):
+                logging.info('Reconnected to %s in %.1f ms' % (self.host, (time.time() - started_at) * 1000))
+                return True
+
+        logging.warning('Server %s is unreachable, back to discovery' % self.host)
+        return False
+
+    def backoff(self, attempt):
+        delay = min(self.reconnect_max_delay, self.reconnect_min_delay * 2 ** (attempt - 1))
+        time.sleep(random.uniform(delay / 2, delay))
+
+    def connectServer(self, host):
+        self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+
+        try:
+            self.sock.settimeout(self.connect_timeout)
+            self.sock.connect((host, self.port))
+            logging.info('Handshake with the server')
+
+            if self.features:
+                request = "%s:%s:%s\n" % (socket.gethostname(), 'handshake', ','.join(self.features))
+            else:
+                request = "%s:%s\n" % (socket.gethostname(), 'handshake')
 
-                if self.interrupt == True:
-                    for arduino in self.ads:
-                        self.ads[arduino].close()
-                    time.sleep(2)
+            self.sock.send(request.encode())
+
+            # Wait for handshake
+            data = self.sock.recv(1024)
+            self.sock.settimeout(None)
+
+            if data:
+                # New servers answer accept:<features they support>
+                udata = data.decode().strip().split(':')
+
+                if udata[0] != 'accept':
+                    logging.warning('Did not accept')
                     self.sock.close()
-                    break
+                    return False
+                else:
+                    self.capabilities = set(udata[1].split(',')) if len(udata) > 1 else set()
+                    logging.info('Accepted, capabilities: %s' % ', '.join(sorted(self.capabilities)))
+            else:
+                logging.warning('Empty response')
+                self.sock.close()
+                return False
+
+        except Exception as e:
+            # Arduino drivers keep running, the server may be back soon
+            logging.warning('Could not connect to %s: %s' % (host, e))
+            self.sock.close()
+            return False
+
+        return True
+
+    def sendMessage(self, message, telemetry = False):
+        if 'bin' in self.capabilities:
+            frame = encode_message(message)
+        else:
+            frame = ("%s\n" % json.dumps(message)).encode()
 
-    def createArduinoDrivers(self):
-        session = self.createSession()
-        node = session.query(Node).filter_by(host_name=self.host_name).first()
+        logging.debug(frame)
+        self.writer.send(frame, telemetry)
 
-        if node is None:
-            session.close()
+    def loadConfig(self, prefer_snapshot = False):
+        if prefer_snapshot:
+            config = load_snapshot(self.snapshot_path, self.host_name)
+
+            if config is not None:
+                logging.info('Use config snapshot, revalidate in background')
+                validator = ConfigValidator(self, config)
+                validator.setDaemon(True)
+                validator.start()
+                return config
+
+        try:
+            session = self.createSession()
+
+            try:
+                config = load_node_config(session, self.host_name)
+            finally:
+                session.close()
+        except Exception as e:
+            logging.exception('DB is unreachable, try the config snapshot')
+            return load_snapshot(self.snapshot_path, self.host_name)
+
+        if config is not None:
+            save_snapshot(config, self.snapshot_path)
+
+        return config
+
+    def createArduinoDrivers(self, prefer_snapshot = False):
+        config = self.loadConfig(prefer_snapshot)
+
+        if config is None:
             return False
 
-        arduinos = node.arduinos.all()
-        session.close()
+        with self.config_lock:
+            # Routes of a port go live once the port is up
+            self.ads = {}
+            self.config = config
+            self.routing.load(config, self.ads)
+            self.status = 'started'
+            self.openArduinoDrivers(config, set(arduino.usb for arduino in config.arduinos))
 
-        if arduinos is not None:
-            for arduino in arduinos:
-                logging.info(str(arduino))
-                ad = ArduinoDriver(self)
-                ad.connect(arduino.usb)
-                self.ads[arduino.usb] = ad
+        return True
+
+    def openArduinoDrivers(self, config, ports):
+        # Called with config_lock held, every port settles on its own in the background
+        for arduino in config.arduinos:
+            if arduino.usb in ports:
+                logging.info('Arduino (id=%r, name=%s, usb=%s)' % (arduino.id, arduino.name, arduino.usb))
+                token = object()
+                self.port_status[arduino.usb] = 'opening'
+                self.port_openings[arduino.usb] = token
+                self.port_pool.submit(self.openArduinoDriver, arduino.usb, token)
+
+    def openArduinoDriver(self, usb, token):
+        started_at = time.time()
+        ad = ArduinoDriver(self)
+
+        try:
+            ad.connect(usb)
+        except Exception as e:
+            logging.exception('Could not open Arduino %s' % usb)
+            ad = None
+
+        with self.config_lock:
+            wanted = self.port_openings.get(usb) is token
+
+            if wanted:
+                del self.port_openings[usb]
+
+                if ad is None:
+                    self.port_status[usb] = 'failed'
+                else:
+                    # Routes of the port go live with the config of the moment
+                    self.ads[usb] = ad
+                    self.port_status[usb] = 'ready'
+                    self.routing.load(self.config, self.ads)
+
+        if not wanted:
+            # Stopped or removed while opening
+            if ad is not None:
+                ad.close()
+
+            return
+
+        if ad is not None:
+            logging.info('Arduino %s ready in %.0f ms' % (usb, (time.time() - started_at) * 1000))
+
+    def closeArduinoDrivers(self):
+        # Returns once every driver thread stopped, or the timeout passed
+        started_at = time.time()
+
+        with self.config_lock:
+            ads = list(self.ads.values())
+            self.ads = {}
+            self.port_status = {}
+            self.port_openings = {}
+            self.routing.clear()
+
+            for ad in ads:
+                ad.stop()
+
+            deadline = started_at + ArduinoDriver.close_timeout
+
+            for ad in ads:
+                ad.join(max(deadline - time.time(), 0))
+
+        elapsed = time.time() - started_at
+        logging.info('Closed %d Arduinos in %.1f ms' % (len(ads), elapsed * 1000))
+
+        return elapsed
+
+    def applyConfig(self, config):
+        with self.config_lock:
+            if self.status != 'started':
+                # Drivers will be created from the snapshot on the next start
+                self.config = config
+                return
+
+            current = set(arduino.usb for arduino in self.config.arduinos)
+            ports = set(arduino.usb for arduino in config.arduinos)
+
+            # Ports that failed to open or whose driver threads died get another try
+            failed = set(usb for usb in current & ports if self.port_status.get(usb) == 'failed')
+            dead = set(usb for usb in current & ports if usb in self.ads and not self.ads[usb].isAlive())
+
+            for usb in dead:
+                logging.warning('Reopen Arduino %s, a driver thread died' % usb)
+                self.ads.pop(usb).close()
+
+            failed |= dead
+
+            for usb in current - ports:
+                logging.info('Close removed Arduino %s' % usb)
+                self.port_status.pop(usb, None)
+                self.port_openings.pop(usb, None)
+
+                if usb in self.ads:
+                    self.ads.pop(usb).close()
+
+            # Unchanged ports keep their serial link and queued commands,
+            # routes of the new ports go live once they are up
+            self.config = config
+            changed = self.routing.load(config, self.ads)
+            self.openArduinoDrivers(config, (ports - current) | failed)
+
+            logging.info('Config applied: %d ports opening, %d closed, %d kept, %d routes changed' % (
+                len((ports - current) | failed), len(current - ports), len((current & ports) - failed), changed))
+
+    def getStats(self):
+        # Answer to the stats control event
+        with self.config_lock:
+            ads = dict(self.ads)
+            ports = dict((usb, {'status': status}) for usb, status in self.port_status.items())
+
+        for usb in ads:
+            ports.setdefault(usb, {}).update(ads[usb].getStats())
+
+        stats = {
+            'dispatcher': self.dispatcher.getStats(),
+            'writer': self.writer.getStats(),
+            'ports': ports
+        }
+
+        if self.db is not None:
+            stats['db'] = self.db.getStats()
+
+        return stats
+
+    def startIrSession(self, frames):
+        # The capture runs on its own thread, control events go on meanwhile
+        if self.ir_session is not None and self.ir_session.is_alive():
+            logging.warning('IR capture is already running')
+            return False
 
-        self.status = 'started'
+        self.ir_session = IrSession(self, helper.create_backend(), frames)
+        self.ir_session.setDaemon(True)
+        self.ir_session.start()
 
         return True
 
@@ -0,0 +1,221 @@
+import os, json, tempfile, threading, logging
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from .models import Node, Arduino, Radio, Button
+
+SNAPSHOT_VERSION = 1
+
+NodeConfig = namedtuple('NodeConfig', ['id', 'name', 'host_name', 'timestamp', 'arduinos'])
+ArduinoConfig = namedtuple('ArduinoConfig', ['id', 'usb', 'name', 'order', 'timestamp', 'radios'])
+RadioConfig = namedtuple('RadioConfig', ['id', 'pipe', 'type', 'name', 'enabled', 'order', 'on_request', 'expired_after', 'timestamp', 'buttons'])
+ButtonConfig = namedtuple('ButtonConfig', ['id', 'name', 'type', 'message', 'timestamp'])
+
+def load_node_config(session, host_name):
+    # Node, arduinos and radios in one joined query, buttons in a second one
+    node = session.query(Node) \
+        .options(joinedload(Node.arduinos).joinedload(Arduino.radios)) \
+        .filter_by(host_name=host_name) \
+        .first()
+
+    if node is None:
+        return None
+
+    radio_ids = [radio.id for arduino in node.arduinos for radio in arduino.radios]
+    buttons = {}
+
+    if radio_ids:
+        for button in session.query(Button).filter(Button.radio_id.in_(radio_ids)):
+            buttons.setdefault(button.radio_id, []).append(ButtonConfig(
+                id=button.id,
+                name=button.name,
+                type=button.type,
+                message=button.message,
+                timestamp=button.timestamp))
+
+    arduinos = []
+
+    for arduino in node.arduinos:
+        radios = []
+
+        for radio in arduino.radios:
+            radios.append(RadioConfig(
+                id=radio.id,
+                pipe=radio.pipe,
+                type=radio.type,
+                name=radio.name,
+                enabled=radio.enabled,
+                order=radio.order,
+                on_request=radio.on_request,
+                expired_after=radio.expired_after,
+                timestamp=radio.timestamp,
+                buttons=tuple(buttons.get(radio.id, ()))))
+
+        arduinos.append(ArduinoConfig(
+            id=arduino.id,
+            usb=arduino.usb,
+            name=arduino.name,
+            order=arduino.order,
+            timestamp=arduino.timestamp,
+            radios=tuple(radios)))
+
+    return NodeConfig(
+        id=node.id,
+        name=node.name,
+        host_name=node.host_name,
+        timestamp=node.timestamp,
+        arduinos=tuple(arduinos))
+
+def config_version(config):
+    # Counts catch deleted rows, timestamps catch updated ones
+    arduinos = config.arduinos
+    radios = [radio for arduino in arduinos for radio in arduino.radios]
+    buttons = [button for radio in radios for button in radio.buttons]
+
+    return (
+        config.id,
+        config.timestamp,
+        len(arduinos), _max_timestamp(arduinos),
+        len(radios), _max_timestamp(radios),
+        len(buttons), _max_timestamp(buttons))
+
+def load_config_version(session, host_name):
+    node = session.query(Node.id, Node.timestamp).filter_by(host_name=host_name).first()
+
+    if node is None:
+        return None
+
+    arduinos = session.query(func.count(Arduino.id), func.max(Arduino.timestamp)) \
+        .filter(Arduino.node_id == node.id) \
+        .one()
+    radios = session.query(func.count(Radio.id), func.max(Radio.timestamp)) \
+        .join(Arduino, Radio.arduino_id == Arduino.id) \
+        .filter(Arduino.node_id == node.id) \
+        .one()
+    buttons = session.query(func.count(Button.id), func.max(Button.timestamp)) \
+        .join(Radio, Button.radio_id == Radio.id) \
+        .join(Arduino, Radio.arduino_id == Arduino.id) \
+        .filter(Arduino.node_id == node.id) \
+        .one()
+
+    return (node.id, node.timestamp) + tuple(arduinos) + tuple(radios) + tuple(buttons)
+
+def _max_timestamp(rows):
+    timestamps = [row.timestamp for row in rows if row.timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+def save_snapshot(config, path):
+    # Namedtuples are stored as plain lists in field order
+    data = {'version': SNAPSHOT_VERSION, 'node': config}
+
+    try:
+        # A temp file of its own, the validator and a start may save at the same time
+        fd, tmp_path = tempfile.mkstemp(prefix='.snapshot.', dir=os.path.dirname(os.path.abspath(path)))
+    except OSError as e:
+        logging.warning('Could not save config snapshot %s: %s' % (path, e))
+        return False
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'), default=_encode_timestamp)
+
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning('Could not save config snapshot %s: %s' % (path, e))
+
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        return False
+
+    return True
+
+def load_snapshot(path, host_name):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+
+        if data.get('version') != SNAPSHOT_VERSION:
+            logging.warning('Unsupported config snapshot version: %r' % data.get('version'))
+            return None
+
+        config = _decode_node(data['node'])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.exception('Broken config snapshot: %s' % path)
+        return None
+
+    if config.host_name != host_name:
+        logging.warning('Config snapshot belongs to %s' % config.host_name)
+        return None
+
+    return config
+
+def _encode_timestamp(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    raise TypeError('%r is not JSON serializable' % value)
+
+def _decode_timestamp(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+def _decode_node(row):
+    node = NodeConfig(*row)
+    return node._replace(
+        timestamp=_decode_timestamp(node.timestamp),
+        arduinos=tuple(_decode_arduino(a) for a in node.arduinos))
+
+def _decode_arduino(row):
+    arduino = ArduinoConfig(*row)
+    return arduino._replace(
+        timestamp=_decode_timestamp(arduino.timestamp),
+        radios=tuple(_decode_radio(r) for r in arduino.radios))
+
+def _decode_radio(row):
+    radio = RadioConfig(*row)
+    return radio._replace(
+        timestamp=_decode_timestamp(radio.timestamp),
+        buttons=tuple(_decode_button(b) for b in radio.buttons))
+
+def _decode_button(row):
+    button = ButtonConfig(*row)
+    return button._replace(timestamp=_decode_timestamp(button.timestamp))
+
+class ConfigValidator(threading.Thread):
+
+    def __init__(self, app, config):
+        threading.Thread.__init__(self)
+        self.app = app
+        self.config = config
+
+    def run(self):
+        try:
+            session = self.app.createSession()
+
+            try:
+                version = load_config_version(session, self.app.host_name)
+
+                if version is None:
+                    logging.warning('The node not found in DB, keep serving from the snapshot')
+                    return
+
+                if version == config_version(self.config):
+                    logging.info('Config snapshot is up to date')
+                    return
+
+                logging.info('Config snapshot is stale, reload')
+                config = load_node_config(session, self.app.host_name)
+            finally:
+                session.close()
+        except Exception as e:
+            logging.exception('DB is unreachable, keep serving from the snapshot')
+            return
+
+        if config is not None:
+            save_snapshot(config, self.app.snapshot_path)
+            self.app.applyConfig(config)
@@ -0,0 +1,76 @@
+import threading, time, logging
+from sqlalchemy import create_engine, exc
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+
+class PoolStats():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait, timeout = False):
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            if timeout:
+                self.timeouts += 1
+
+    def getStats(self):
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'avg_wait_ms': self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+class TimedQueuePool(QueuePool):
+    # Shared by every pool the engine recreates
+    stats = PoolStats()
+
+    def _do_get(self):
+        start_at = time.perf_counter()
+
+        try:
+            conn = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start_at, True)
+            raise
+
+        self.stats.record(time.perf_counter() - start_at)
+        return conn
+
+class Database():
+
+    def __init__(self, uri, pool_size = 5, max_overflow = 5, pool_recycle = 3600, pool_pre_ping = True, pool_timeout = 10):
+        self.engine = create_engine(uri,
+            poolclass=TimedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            pool_timeout=pool_timeout)
+        # Every worker thread gets its own session
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+
+    def createSession(self):
+        return self.Session()
+
+    def removeSession(self):
+        self.Session.remove()
+
+    def getStats(self):
+        pool = self.engine.pool
+        stats = pool.stats.getStats()
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow()
+        })
+        return stats
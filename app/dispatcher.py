@@ -0,0 +1,88 @@
+import threading, queue, logging
+
+class EventDispatcher():
+
+    def __init__(self, workers = 4, max_pending = 256):
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.next_worker = 0
+        self.workers = []
+
+        for i in range(workers):
+            worker = EventWorker(self, i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, key, task):
+        # Tasks with the same key always land on the same worker and keep their order
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                logging.warning('Event queue is full (%d), rejected key: %s' % (self.pending, key))
+                return False
+
+            self.pending += 1
+            self.submitted += 1
+
+            if key is None:
+                index = self.next_worker
+                self.next_worker = (self.next_worker + 1) % len(self.workers)
+            else:
+                index = hash(key) % len(self.workers)
+
+        self.workers[index].tasks.put(task)
+        return True
+
+    def taskDone(self, failed):
+        with self.lock:
+            self.pending -= 1
+            self.processed += 1
+
+            if failed:
+                self.failed += 1
+
+    def getStats(self):
+        with self.lock:
+            return {
+                'depth': self.pending,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'processed': self.processed,
+                'failed': self.failed,
+                'workers': [w.tasks.qsize() for w in self.workers]
+            }
+
+    def close(self):
+        for worker in self.workers:
+            worker.tasks.put(None)
+
+class EventWorker(threading.Thread):
+
+    def __init__(self, dispatcher, index):
+        threading.Thread.__init__(self, name='EventWorker-%d' % index)
+        self.dispatcher = dispatcher
+        self.tasks = queue.Queue()
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+
+            # Terminate the worker
+            if task is None:
+                break
+
+            failed = False
+
+            try:
+                task()
+            except Exception as e:
+                failed = True
+                logging.exception('Event worker error')
+
+            self.dispatcher.taskDone(failed)
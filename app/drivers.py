@@ -1,4 +1,4 @@
-import threading, queue, sys, logging
+import threading, queue, collections, heapq, sys, os, selectors, math, logging
 import serial
 import time, random, json
 
@@ -7,11 +7,13 @@ class ArduinoDriver():
     ser_timeout = 0.5
     ser_baudrate = 500000
     queue = None
-    items_buffer = []
+    # Seconds to wait for the driver threads on close
+    close_timeout = 2
 
     def __init__(self, app):
         self.app = app
         self.writer = SerialWriter()
+        self.request_buffer = RequestBuffer()
 
     def connect(self, port):
         if self.app.emulation == True:
@@ -29,56 +31,63 @@ class ArduinoDriver():
         self.ser.flushInput()
         self.ser.flushOutput()
         self.pm = PackageManager(self, self.app)
-        self.aq = ArduinoQueue(self.app, self.ser, self.pm)
+        self.sr = SerialReader(self.app, self.ser, self.pm)
+        self.aq = ArduinoQueue(self.app, self.ser, self.sr)
+        self.aq.window = self.app.serial_windows.get(port, 1)
         self.pm.setDaemon(True)
+        self.sr.setDaemon(True)
         self.aq.setDaemon(True)
         self.pm.start()
+        self.sr.start()
         self.aq.start()
 
-    def close(self):
+    def stop(self):
+        # Signals every thread, join() waits for them
         logging.info('Close Driver %s' % self.ser.port)
-        self.writer.is_running = False
-        self.aq.is_running = False
-        self.pm.is_running = False
-
-    def addToQueue(self, item):
-        self.aq.workQueue.put(item)
-    
-    def addToRequestBuffer(self, item):
-        order = 1
+        self.writer.stop()
+        self.aq.stop()
+        self.pm.stop()
+        self.sr.stop()
+
+    def join(self, timeout = None):
+        deadline = None if timeout is None else time.time() + timeout
+        stopped = True
+
+        for thread in [self.aq, self.sr, self.pm, self.writer]:
+            # The emulator writer is not started on real ports
+            if thread.ident is None:
+                continue
 
-        for i in self.items_buffer:
-            if i.getRadioPipe() == item.getRadioPipe():
-                order += 1
+            thread.join(None if deadline is None else max(deadline - time.time(), 0))
 
-        item.setOrder(order)
-        self.items_buffer.append(item)
-        logging.info('Add with order: %d pipe: %s' % (order, item.getRadioPipe()))
+            if thread.is_alive():
+                logging.warning('%s of %s did not stop in time' % (thread.__class__.__name__, self.ser.port))
+                stopped = False
 
-    def getFromRequestBuffer(self, pipe):
-        first = None
-        expired = []
+        # The port is closed only after its reader let go of it
+        if not self.sr.is_alive():
+            self.ser.close()
 
-        for i in self.items_buffer:
-            if i.isExpired():
-                expired.append(self.items_buffer.index(i))
-                continue
+        return stopped
 
-            if i.getRadioPipe() == pipe:
-                if first == None:
-                    first = i
-                else:
-                    if i.getOrder() < first.getOrder():
-                        first = i
+    def close(self, timeout = None):
+        self.stop()
+        return self.join(self.close_timeout if timeout is None else timeout)
 
-        if first is not None:
-            index = self.items_buffer.index(first)
-            first = self.items_buffer.pop(index)
+    def isAlive(self):
+        # A driver without any of its serial threads does not work anymore
+        return self.sr.is_alive() and self.aq.is_alive() and self.pm.is_alive()
 
-        for ex in expired:
-            self.items_buffer.pop(ex)
+    def addToQueue(self, item):
+        self.aq.workQueue.put(item)
+        self.aq.wakeup()
+    
+    def addToRequestBuffer(self, item):
+        order = self.request_buffer.add(item)
+        logging.info('Add with order: %d pipe: %s' % (order, item.getRadioPipe()))
 
-        return first
+    def getFromRequestBuffer(self, pipe):
+        return self.request_buffer.get(pipe)
     
     def checkRequest(self, package):
         item = self.getFromRequestBuffer(package.getRadioPipe())
@@ -89,109 +98,454 @@ class ArduinoDriver():
 
         self.addToQueue(item)
 
+    def getStats(self):
+        return {
+            'queue': self.aq.workQueue.getStats(),
+            'requests': self.request_buffer.getStats()
+        }
+
+class RequestBuffer():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # FIFO of waiting items per radio pipe
+        self.pipes = {}
+        # Min-heap of (expired_at, sequence, item), delivered items are skipped lazily
+        self.expirations = []
+        self.sequence = 0
+        self.stats = {}
+
+    def add(self, item):
+        pipe = item.getRadioPipe()
+
+        with self.lock:
+            items = self.pipes.setdefault(pipe, collections.deque())
+            items.append(item)
+            heapq.heappush(self.expirations, (item.expired_at, self.sequence, item))
+            self.sequence += 1
+            self.getPipeStats(pipe)['buffered'] += 1
+            order = len(items)
+
+        item.setOrder(order)
+        return order
+
+    def get(self, pipe):
+        with self.lock:
+            self.expire()
+            items = self.pipes.get(pipe)
+
+            if not items:
+                return None
+
+            item = items.popleft()
+            item.delivered = True
+            self.getPipeStats(pipe)['delivered'] += 1
+
+            return item
+
+    def expire(self):
+        now = time.time()
+
+        while self.expirations and self.expirations[0][0] < now:
+            expired_at, sequence, item = heapq.heappop(self.expirations)
+
+            if item.delivered:
+                continue
+
+            items = self.pipes[item.getRadioPipe()]
+
+            # Items of one pipe usually expire in FIFO order
+            if items[0] is item:
+                items.popleft()
+            else:
+                items.remove(item)
+
+            self.getPipeStats(item.getRadioPipe())['expired'] += 1
+
+    def getPipeStats(self, pipe):
+        if pipe not in self.stats:
+            self.stats[pipe] = {'buffered': 0, 'delivered': 0, 'expired': 0}
+
+        return self.stats[pipe]
+
+    def getStats(self):
+        with self.lock:
+            self.expire()
+            stats = {}
+
+            for pipe in self.stats:
+                stats[ord(pipe)] = dict(self.stats[pipe], waiting=len(self.pipes.get(pipe, ())))
+
+            return stats
+
 class PackageManager(threading.Thread):
 
     def __init__(self, ad, app):
         threading.Thread.__init__(self)
-        self.is_running = True
+        self.stopping = threading.Event()
         self.ad = ad
         self.app = app
         self.packageQueue = queue.Queue()
         self.buffer = {}
+        # Min-heap of (deadline, sequence, package), stale entries are skipped
+        self.deadlines = []
+        self.sequence = 0
 
     def run(self):
         while True:
             # Terminate the process
-            if self.is_running == False:
+            if self.stopping.is_set():
                 logging.info('Stop PackageManager')
                 break
-            
-            if not self.packageQueue.empty():
-                sp = self.packageQueue.get()
-                pipe = sp.getRadioPipe()
 
-                if pipe not in self.buffer:
-                    if sp.getPackageNumber() == 0:
-                        self.buffer[pipe] = Package(sp)
-                else:
-                    self.buffer[pipe].append(sp)
+            try:
+                sp = self.packageQueue.get(timeout=self.nextTimeout())
+            except queue.Empty:
+                sp = None
 
-                self.checkPackages()
-            else:
-                self.checkPackages()
-                time.sleep(0.01)
+            if sp is not None:
+                self.handlePackage(sp)
+
+            self.expirePackages()
+
+    def stop(self):
+        self.stopping.set()
+        # Unblocks a waiting get()
+        self.packageQueue.put(None)
 
     def addPackage(self, sp):
         self.packageQueue.put(sp)
 
-    def checkPackages(self):
-        for_del = []
-
-        for package in self.buffer:
-            if self.buffer[package].complete:
-                if self.buffer[package].getType() == 'ev':
-                    logging.info('ev')
-                    se = SocketEvent(self.app, self.buffer[package])
-                    se.setDaemon(True)
-                    se.start()
-                elif self.buffer[package].getType() == 'rq':
-                    logging.info('rq')
-                    self.ad.checkRequest(self.buffer[package])
-                
-                for_del.append(package)
-                    
-            elif self.buffer[package].expired():
-                for_del.append(package)
-        
-        for p in for_del:
-            del self.buffer[p]
+    def nextTimeout(self):
+        if not self.deadlines:
+            return 1
+
+        return min(max(self.deadlines[0][0] - time.time(), 0), 1)
+
+    def handlePackage(self, sp):
+        pipe = sp.getRadioPipe()
+
+        if pipe not in self.buffer:
+            if sp.getPackageNumber() != 0:
+                return
+
+            package = Package(sp)
+        else:
+            package = self.buffer[pipe]
+            package.append(sp)
+
+        if package.complete:
+            # Dispatch as soon as the last fragment arrives
+            self.buffer.pop(pipe, None)
+            self.dispatch(package)
+        else:
+            self.buffer[pipe] = package
+            heapq.heappush(self.deadlines, (package.updated_at + Package.ttl, self.sequence, package))
+            self.sequence += 1
+
+    def expirePackages(self):
+        now = time.time()
+
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, sequence, package = heapq.heappop(self.deadlines)
+            pipe = package.getRadioPipe()
+
+            # Skip packages already dispatched or updated after this deadline
+            if self.buffer.get(pipe) is package and package.expired():
+                logging.debug('Package expired, pipe: %r' % pipe)
+                del self.buffer[pipe]
+
+    def dispatch(self, package):
+        if package.getType() == 'ev':
+            logging.info('ev')
+            self.app.telemetry.addPackage(package)
+        elif package.getType() == 'rq':
+            logging.info('rq')
+            self.ad.checkRequest(package)
 
 class ArduinoQueue(threading.Thread):
 
-    def __init__(self, app, ser, pm):
+    def __init__(self, app, ser, sr):
         threading.Thread.__init__(self)
-        self.is_running = True
+        self.stopping = threading.Event()
         self.app = app
         self.ser = ser
-        self.pm = pm
-        self.workQueue = queue.Queue()
-        # self.workQueue = queue.PriorityQueue()
+        self.sr = sr
+        self.workQueue = ArduinoScheduler()
+        self.started = threading.Event()
+        # Max chunks in flight, 1 is stop-and-wait
+        self.window = 1
+
+    def wakeup(self):
+        self.started.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.started.set()
+        self.workQueue.interrupt()
 
     def run(self):
         while True:
             # Terminate the process
-            if self.is_running == False:
+            if self.stopping.is_set():
                 logging.info('Stop ArduinoQueue')
                 break
 
             if self.app.status != 'started':
-                time.sleep(1)
+                # Commands wait until the service is started
+                self.started.wait(1)
+                self.started.clear()
                 continue
 
-            if not self.workQueue.empty():
-                queue_item = self.workQueue.get()
-                queue_item.run(self.pm, self.ser)
+            queue_item = self.workQueue.get(timeout=1)
+
+            if queue_item is not None:
+                queue_item.run(self.sr, self.ser, min(self.window, self.sr.credits))
+
+class ArduinoScheduler():
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # priority -> pipe -> FIFO of (queued_at, item), pipes are served round-robin
+        self.classes = {}
+        self.size = 0
+        self.interrupted = False
+        self.wait_stats = {}
+
+    def put(self, item):
+        # The first byte of a message is the radio pipe
+        pipe = item.message[:1]
+
+        with self.condition:
+            pipes = self.classes.setdefault(item.priority, collections.OrderedDict())
+            pipes.setdefault(pipe, collections.deque()).append((time.time(), item))
+            self.size += 1
+            self.condition.notify()
+
+    def get(self, timeout = None):
+        with self.condition:
+            if self.size == 0 and not self.interrupted:
+                self.condition.wait(timeout)
+
+            self.interrupted = False
+
+            if self.size == 0:
+                return None
+
+            # Lower number is served first
+            priority = min(self.classes)
+            pipes = self.classes[priority]
+            pipe, items = next(iter(pipes.items()))
+            queued_at, item = items.popleft()
+
+            if items:
+                pipes.move_to_end(pipe)
+            else:
+                del pipes[pipe]
+
+            if not pipes:
+                del self.classes[priority]
+
+            self.size -= 1
+            self.recordWait(priority, time.time() - queued_at)
+
+            return item
+
+    def interrupt(self):
+        with self.condition:
+            self.interrupted = True
+            self.condition.notify_all()
+
+    def empty(self):
+        return self.size == 0
+
+    def recordWait(self, priority, wait):
+        if priority not in self.wait_stats:
+            self.wait_stats[priority] = {'count': 0, 'total': 0.0, 'max': 0.0}
+
+        stats = self.wait_stats[priority]
+        stats['count'] += 1
+        stats['total'] += wait
+        stats['max'] = max(stats['max'], wait)
+
+    def getStats(self):
+        with self.condition:
+            stats = {}
+
+            for priority in self.wait_stats:
+                wait = self.wait_stats[priority]
+                pipes = self.classes.get(priority, {})
+                stats[priority] = {
+                    'count': wait['count'],
+                    'avg_wait_ms': wait['total'] / wait['count'] * 1000,
+                    'max_wait_ms': wait['max'] * 1000,
+                    'waiting': sum(len(items) for items in pipes.values())
+                }
+
+            return stats
+
+class SerialReader(threading.Thread):
+    # Responses of the Arduino to a written chunk
+    ack_responses = [':next:', ':success:', ':overflow:', ':timeout:', ':fail:']
+
+    def __init__(self, app, ser, pm):
+        threading.Thread.__init__(self)
+        self.stopping = threading.Event()
+        self.app = app
+        self.ser = ser
+        self.pm = pm
+        self.ack_lock = threading.Lock()
+        self.acks = collections.deque()
+        # Free chunk slots advertised by the Arduino with :next N:
+        self.credits = 1
+        self.wakeup_lock = threading.Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+
+    def wakeup(self):
+        with self.wakeup_lock:
+            if self.wakeup_w is None:
+                return
+
+            try:
+                os.write(self.wakeup_w, b'\0')
+            except BlockingIOError:
+                # The pipe is full, the loop is going to wake up anyway
+                pass
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup()
+
+        # A chunk waiting for its ack gives up right away
+        with self.ack_lock:
+            acks = list(self.acks)
+            self.acks.clear()
+
+        for ack in acks:
+            ack.setResult(':cancel:')
+
+    def expectAck(self):
+        # Must be called before the chunk is written, the ack may come back at once
+        ack = AckFuture()
+
+        with self.ack_lock:
+            self.acks.append(ack)
+
+        return ack
+
+    def dropAcks(self, acks, timeout):
+        # Responses to chunks still in flight are waited out, a late one would be taken for the next message
+        deadline = time.time() + timeout
+
+        for ack in acks:
+            ack.wait(max(deadline - time.time(), 0))
+
+        with self.ack_lock:
+            for ack in acks:
+                if ack in self.acks:
+                    self.acks.remove(ack)
+
+    def run(self):
+        # Acks have to flow whenever a chunk is written, so the reader ignores app.status
+        ready = selectors.DefaultSelector()
+        ready.register(self.wakeup_r, selectors.EVENT_READ)
+        ready.register(self.ser.fileno(), selectors.EVENT_READ)
+
+        while True:
+            # Terminate the process
+            if self.stopping.is_set():
+                logging.info('Stop SerialReader')
+                break
+
+            if self.ser.in_waiting > 0:
+                self.handleLine(self.ser.readline())
+            else:
+                # Block until serial data arrives
+                self.waitFor(ready, 1)
+
+        ready.close()
+
+        with self.wakeup_lock:
+            os.close(self.wakeup_r)
+            os.close(self.wakeup_w)
+            self.wakeup_w = None
+
+    def handleLine(self, line):
+        if line[:1] != b':':
+            # Radio frames are parsed as bytes
+            if line.strip():
+                self.pm.addPackage(SerialPackage(line, self.ser.port))
             else:
-                if self.ser.in_waiting > 0:
-                    # logging.info('AAAA')
-                    response = self.ser.readline()
-                    response = response.decode('ascii', 'replace')
-                    self.pm.addPackage(SerialPackage(response, self.ser.port))
-                else:
-                    # logging.info('BBB')
-                    # time.sleep(1)
-                    time.sleep(0.05)
+                logging.warning('empty response')
+            return
+
+        stripped = line.decode('ascii', 'replace').strip()
+
+        if stripped == '':
+            logging.warning('empty response')
+        elif stripped == ':ack:':
+            pass
+        elif stripped.startswith(':next ') and stripped.endswith(':'):
+            try:
+                self.credits = max(1, int(stripped[6:-1]))
+            except ValueError:
+                logging.warning('Broken credits: %s' % stripped)
+
+            self.resolveAck(':next:')
+        elif stripped in self.ack_responses:
+            self.resolveAck(stripped)
+        else:
+            self.pm.addPackage(SerialPackage(line, self.ser.port))
+
+    def resolveAck(self, response):
+        # Chunks are acknowledged in the order they were written
+        with self.ack_lock:
+            ack = self.acks.popleft() if self.acks else None
+
+        if ack is None:
+            logging.warning('Unexpected response: %s' % response)
+        else:
+            ack.setResult(response)
+
+    def waitFor(self, selector, timeout):
+        for key, events in selector.select(timeout):
+            if key.fd == self.wakeup_r:
+                try:
+                    while os.read(self.wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+
+class AckFuture():
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+    def setResult(self, result):
+        self.result = result
+        self.event.set()
+
+    def wait(self, timeout):
+        if self.event.wait(timeout):
+            return self.result
+
+        return None
 
 class ArduinoQueueItem():
 
     def __init__(self, message, priority):
         self.buffer   = 64
+        self.ack_timeout = 1
         self.execute  = ''
-        self.message  = message
+        self.message  = message.encode() if isinstance(message, str) else message
         self.priority = priority
         self.expired_at = None
         self.radio_id = None
         self.order = None
+        self.delivered = False
 
     def setExpiration(self, expire_after):
         self.expired_at = time.time() + expire_after
@@ -211,74 +565,69 @@ class ArduinoQueueItem():
     def isExpired(self):
         return (self.expired_at < time.time())
 
-    def run(self, pm, ser):
+    def run(self, sr, ser, window = 1):
         partial_signal = [self.message[i:i+self.buffer] for i in range(0, len(self.message), self.buffer)]
-        
-        for part in partial_signal:
-            logging.info(part)
-            b_arr = bytearray(part.encode())
-            ser.write(b_arr)
+        pending = collections.deque()
+        sent = 0
+
+        while sent < len(partial_signal) or pending:
+            # Keep up to window chunks in flight
+            while sent < len(partial_signal) and len(pending) < window:
+                part = partial_signal[sent]
+                logging.info(part)
+                pending.append(sr.expectAck())
+                ser.write(part)
+                sent += 1
+
             ser.flush()
+            ack = pending.popleft()
+            response = ack.wait(self.ack_timeout)
 
-            error = False
-            start_at = time.time()
-
-            while True:
-                response = ser.readline()
-                response = response.decode('ascii', 'replace')
-
-                if int(time.time() - start_at) > 0.5:
-                    logging.warning('waiting timeout')
-                    error = True
-                    break
-                elif response.strip() == '':
-                    logging.warning('empty response')
-                elif response.strip() == ':next:':
-                    break
-                elif response.strip() == ':overflow:':
-                    logging.warning('overflow')
-                    error = True
-                    break
-                elif response.strip() == ':timeout:':
-                    logging.warning('timeout')
-                    error = True
-                    break
-                elif response.strip() == ':ack:':
-                    continue
-                elif response.strip() == ':fail:':
-                    logging.info('fail')
-                    error = True
-                    break
-                elif response.strip() == ':success:':
-                    logging.info('success')
-                    break
-                else:
-                    pm.addPackage(SerialPackage(response, ser.port))
-                    logging.info(response.strip())
-
-            if error:
+            if response == ':next:':
+                continue
+            elif response == ':success:':
+                logging.info('success')
                 break
 
+            if response is None:
+                logging.warning('waiting timeout')
+                pending.appendleft(ack)
+            else:
+                logging.warning(response.strip(':'))
+
+            break
+
+        if pending:
+            # The Arduino dropped the message, acks of chunks in flight must not reach the next one
+            sr.dropAcks(list(pending), self.ack_timeout)
+
+WHITESPACE = b' \t\r\n\x0b\x0c'
+NUMERIC = '0123456789-+.'
+
 class SerialPackage():
 
     def __init__(self, package, serial_port):
         self.serial_port = serial_port
-        self.package = package.strip()
-        self.is_last = self.package[-1].encode() == b"\x17"
+        # The first byte is a binary pipe number, only the tail is stripped
+        self.package = package.rstrip(WHITESPACE)
+        self.is_last = self.package.endswith(b'\x17')
 
     def getPackage(self):
         return self.package
     
     def getRadioPipe(self):
-        return self.package[:1]
+        return chr(self.package[0]) if self.package else ''
 
     def getPackageNumber(self):
-        if self.package[1:2].isdigit():
-            return int(self.package[1:2])
-        else:
-            logging.debug('broken package: %s' % self.package)
-            logging.debug('package length: %r' % len(self.package))
-            return None
+        number = self.package[1:2]
+
+        if number.isdigit():
+            return number[0] - 48
+
+        logging.debug('broken package: %r' % self.getPackage())
+        logging.debug('package length: %r' % len(self.package))
+
+        return None
 
     def getPayload(self):
         return self.package[2:]
@@ -287,21 +636,24 @@ class SerialPackage():
         return self.serial_port
 
 class Package():
+    # Seconds to wait for the next fragment
+    ttl = 0.1
 
     def __init__(self, sp):
         self.complete = False
         self.updated_at = time.time()
         self.radio_pipe = sp.getRadioPipe()
         self.package_number = 1
-        self.payload = sp.getPayload()
-        self.serial_port = sp.getSerialPort()
+        # Most messages fit in one fragment, longer ones are joined on arrival
+        self.payload = sp.package[2:]
+        self.serial_port = sp.serial_port
         self.type = None
         self.message = ''
 
         self.isComplete(sp)
 
     def expired(self):
-        ex = (time.time() - self.updated_at) > 0.1
+        ex = (time.time() - self.updated_at) >= self.ttl
         return ex
 
     def append(self, sp):
@@ -309,12 +661,13 @@ class Package():
 
         if sp.getPackageNumber() == self.package_number:
             self.package_number += 1
-            self.payload += sp.getPayload()
+            self.payload += sp.package[2:]
             self.isComplete(sp)
         else:
-            logging.warning('The same package: %s' % sp.getPackage())
+            logging.warning('The same package: %r' % sp.getPackage())
 
     def getPayload(self):
+        # Without the trailing \x17
         return self.payload[:-1]
 
     def getMessage(self):
@@ -335,11 +688,10 @@ class Package():
     def isComplete(self, sp):
         if sp.is_last:
             self.complete = True
+            message = parse_payload(self.getPayload())
 
-            try:
-                message = dict(s.split(' ') for s in self.getPayload().split(','))
-            except Exception as e:
-                logging.error('Incorrect message: %s' % self.getPayload())
+            if message is None:
+                logging.error('Incorrect message: %r' % self.getPayload())
                 return
 
             if 'tp' in message and message['tp'] in ['ev', 'rs', 'rq']:
@@ -347,24 +699,39 @@ class Package():
                 del message['tp']
                 self.message = message
 
-class SocketEvent(threading.Thread):
+def parse_payload(payload):
+    # b'tp ev,t 21.30,h 50' -> {'tp': 'ev', 't': '21.30', 'h': '50'}
+    message = {}
 
-    def __init__(self, app, package):
-        threading.Thread.__init__(self)
-        self.app = app
-        self.package = package
+    # One decode for the whole payload, fields are ascii
+    for field in payload.decode('ascii', 'replace').split(','):
+        pair = field.split(' ')
 
-    def run(self):
-        response = "%s\n" % json.dumps({
-            'type': 'event',
-            'result': 'success',
-            'port': self.package.getSerialPort(),
-            'message': self.package.getMessage(),
-            'radio_pipe': self.package.getRadioPipeOrd()
-        })
+        if len(pair) != 2:
+            return None
+
+        message[pair[0]] = pair[1]
+
+    return message
+
+def typed_values(message):
+    # {'t': '21.30', 'h': 'nan'} -> {'t': 21.3, 'h': 'nan'}, JSON has no inf or nan
+    typed = {}
+
+    for key, value in message.items():
+        if value and value[0] in NUMERIC:
+            try:
+                number = float(value)
+            except ValueError:
+                number = None
+
+            if number is not None and math.isfinite(number):
+                typed[key] = number
+                continue
 
-        logging.info(response)
-        self.app.sock.send(response.encode())
+        typed[key] = value
+
+    return typed
 
 class SerialWriter(threading.Thread):
 
@@ -372,29 +739,30 @@ class SerialWriter(threading.Thread):
         threading.Thread.__init__(self)
         self.event_timer = time.time()
         self.request_timer = time.time()
-        self.is_running = True
+        self.stopping = threading.Event()
         self.emulator = None
 
     def setEmulator(self, emulator):
         self.emulator = emulator
 
+    def stop(self):
+        self.stopping.set()
+
     def run(self):
         logging.info('Writer started on %s' % self.emulator.port)
         while True:
             # Terminate the process
-            if self.is_running == False:
+            if self.stopping.is_set():
                 logging.info('Stop SerialWriter')
                 break
             if self.event_timer + 5 < time.time():
                 self.event_timer = time.time()
                 self.emulator.addToBuffer(self.radioEvent())
-                self.emulator.setInwating()
             if self.request_timer + 8 < time.time():
                 self.request_timer = time.time()
                 self.emulator.addToBuffer(self.radioRequest())
-                self.emulator.setInwating()
             else:
-                time.sleep(1)
+                self.stopping.wait(1)
     
     def radioEvent(self):
         temp  = random.uniform(18, 26)
@@ -417,24 +785,29 @@ class SerialEmulator():
 
     def __init__(self, writer):
         self.writer = writer
-        self.in_waiting = 0
         self.baudrate = 9600
         self.timeout = 0
         self.port = None
-        
-        self.buffering = False
-        self.writing = False
 
-        self.input_buffer = []
+        self.input_buffer = collections.deque()
+        self.credits = 4
+        # Pollable fd, holds one byte per buffered line
+        self.ready_r, self.ready_w = os.pipe()
+
+    @property
+    def in_waiting(self):
+        return len(self.input_buffer)
+
+    def fileno(self):
+        return self.ready_r
 
     def addToBuffer(self, item):
         self.input_buffer.append(item)
+        os.write(self.ready_w, b'\0')
     
     def getFromBuffer(self):
-        return self.input_buffer.pop()
-    
-    def setInwating(self):
-        self.in_waiting = 1
+        os.read(self.ready_r, 1)
+        return self.input_buffer.popleft()
 
     def open(self):
         logging.info('SERIAL %s: Opened' % self.port)
@@ -442,6 +815,11 @@ class SerialEmulator():
         self.writer.setDaemon(True)
         self.writer.start()
 
+    def close(self):
+        logging.info('SERIAL %s: Closed' % self.port)
+        os.close(self.ready_r)
+        os.close(self.ready_w)
+
     def flushInput(self):
         logging.info('SERIAL %s: flushInput' % self.port)
 
@@ -452,29 +830,19 @@ class SerialEmulator():
         logging.info('SERIAL %s: flush' % self.port)
 
     def write(self, data):
-        self.writing = True
         logging.info('SERIAL %s: Recieved bytearray' % self.port)
-        logging.info(data.decode())
+        # Packed signals and chunks split inside a character are not text
+        logging.info('%r' % data)
 
+        # The last chunk of a message ends with a new line
         if data[-1] == 10:
-            self.buffering = False
+            self.addToBuffer(b':success:\n')
         else:
-            self.buffering = True
+            self.addToBuffer((':next %d:\n' % self.credits).encode())
 
     def readline(self):
-        if self.writing:
-            if self.buffering == False:
-                self.writing = False
-                return ":success:\n".encode()
-            else:
-                return ":next:\n".encode()
+        if len(self.input_buffer) > 0:
+            return self.getFromBuffer()
         else:
-            if len(self.input_buffer) > 0:
-                i = self.getFromBuffer()
-                if len(self.input_buffer) == 0:
-                    self.in_waiting = 0
-
-                return i
-            else:
-                time.sleep(1)
-                return ''.encode()
+            time.sleep(self.timeout)
+            return ''.encode()
@@ -0,0 +1,167 @@
+import time, queue, collections, logging
+from array import array
+
+class IrCapture():
+
+    def __init__(self, backend, max_edges = 1024, gap_timeout = 0.1, start_timeout = 15):
+        self.backend = backend
+        self.max_edges = max_edges
+        # A frame ends when the line stays idle this long
+        self.gap_timeout = gap_timeout
+        self.start_timeout = start_timeout
+        # Edge timestamps in monotonic ns, reused by every capture
+        self.edges = array('q', bytes(8 * max_edges))
+        self.count = 0
+
+    def capture(self):
+        # Returns the pulse lengths in us, None when no signal came
+        self.count = 0
+        self.backend.open()
+
+        try:
+            deadline = time.monotonic() + self.start_timeout
+
+            logging.info('--- Waiting for signal ---')
+
+            while True:
+                edge = self.backend.waitEdge(max(deadline - time.monotonic(), 0))
+
+                if edge is None:
+                    logging.info('--- Timeout ---')
+                    return None
+
+                # The receiver idles at 1, a frame starts with a falling edge
+                level, timestamp = edge
+
+                if level == 0:
+                    break
+
+            logging.info('--- Start to catch signal ---')
+            self.edges[0] = timestamp
+            self.count = 1
+
+            while self.count < self.max_edges:
+                edge = self.backend.waitEdge(self.gap_timeout)
+
+                if edge is None:
+                    break
+
+                self.edges[self.count] = edge[1]
+                self.count += 1
+            else:
+                logging.warning('Capture is full, %d edges' % self.max_edges)
+        finally:
+            self.backend.close()
+
+        logging.info('--- Finish to catch signal ---')
+
+        if self.count < 2:
+            # A lone edge is noise
+            return None
+
+        return self.getPulses()
+
+    def getPulses(self):
+        edges = self.edges
+        return [(edges[i + 1] - edges[i]) // 1000 for i in range(self.count - 1)]
+
+def merge_frames(frames, tolerance = 0.3):
+    # Averages frames of the most common length pulse by pulse, frames far off the median are dropped
+    length = collections.Counter(len(frame) for frame in frames).most_common(1)[0][0]
+    aligned = [frame for frame in frames if len(frame) == length]
+    median = [sorted(column)[len(column) // 2] for column in zip(*aligned)]
+    kept = [frame for frame in aligned if all(abs(pulse - middle) <= middle * tolerance for pulse, middle in zip(frame, median))]
+
+    if not kept:
+        kept = aligned
+
+    template = []
+    variance = []
+
+    for column in zip(*kept):
+        mean = sum(column) / len(column)
+        template.append(int(round(mean)))
+        variance.append(sum((pulse - mean) ** 2 for pulse in column) / len(column))
+
+    return template, variance, len(kept)
+
+class GpioBackend():
+
+    def __init__(self, pin = 12):
+        # Board pin 12 is also referred to as GPIO18
+        self.pin = pin
+        self.edges = queue.SimpleQueue()
+        self.GPIO = None
+
+    def open(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.edges = queue.SimpleQueue()
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(self.pin, GPIO.IN)
+        # The callback runs on the RPi.GPIO thread for every edge
+        GPIO.add_event_detect(self.pin, GPIO.BOTH, callback=self.onEdge)
+
+    def onEdge(self, channel):
+        timestamp = time.monotonic_ns()
+        self.edges.put((self.GPIO.input(channel), timestamp))
+
+    def waitEdge(self, timeout):
+        try:
+            return self.edges.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if self.GPIO is not None:
+            self.GPIO.remove_event_detect(self.pin)
+            self.GPIO.cleanup(self.pin)
+
+class ReplayBackend():
+
+    def __init__(self, source, realtime = False, lead_in = 0):
+        # source is a file or a list of pulse lengths in us, like read_signal returns
+        if isinstance(source, str):
+            with open(source) as f:
+                source = f.read().split()
+
+        self.pulses = [int(pulse) for pulse in source]
+        # Real time replay sleeps until every edge, otherwise edges come at once
+        self.realtime = realtime
+        self.lead_in = lead_in
+
+    def open(self):
+        self.position = 0
+        self.now = time.monotonic_ns()
+        self.next_at = self.now + int(self.lead_in * 1000000000)
+
+    def waitEdge(self, timeout):
+        timeout_ns = int(timeout * 1000000000)
+
+        # Nothing but the idle line after the last edge
+        if self.position > len(self.pulses) or self.next_at - self.now > timeout_ns:
+            self.sleepUntil(self.now + timeout_ns)
+            return None
+
+        self.sleepUntil(self.next_at)
+        edge = (1 if self.position % 2 else 0, self.next_at)
+
+        if self.position < len(self.pulses):
+            self.next_at += self.pulses[self.position] * 1000
+
+        self.position += 1
+
+        return edge
+
+    def sleepUntil(self, timestamp):
+        # The clock is virtual unless the replay runs in real time
+        if self.realtime:
+            delay = (timestamp - time.monotonic_ns()) / 1000000000
+
+            if delay > 0:
+                time.sleep(delay)
+
+        self.now = timestamp
+
+    def close(self):
+        pass
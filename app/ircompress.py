@@ -0,0 +1,155 @@
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Pulses up to the first value are zeros, below the second ones, the rest is sent as it is
+DEFAULT_THRESHOLDS = (1000, 1800)
+# Sorted pulse widths further apart than this ratio start a new cluster
+CLUSTER_RATIO = 1.4
+# Pulses more than this above the middle one of the ones cluster are sent as they are,
+# single linkage chains the 2250 us NEC repeat space to the 1690 us ones
+ONE_TOLERANCE = 0.25
+# Arduino int is too small for longer pulses
+MAX_PULSE = 65000
+# Shorter frames go through plain Python, numpy only pays off above its per-call overhead
+NUMPY_MIN_PULSES = 100
+
+def read_pulses(signal, tokens, skip = 2):
+    # Pulse widths after the first skip tokens, numpy parses long signals in C
+    if np is not None and len(tokens) >= NUMPY_MIN_PULSES:
+        pulses = np.fromstring(signal, dtype=np.int64, sep=' ')
+
+        # Anything int() would not take the same way goes the slow path
+        if len(pulses) == len(tokens):
+            return pulses[skip:]
+
+    return list(map(int, tokens[skip:]))
+
+def learn_thresholds(pulses):
+    # Single linkage clustering of the widths, the two most common clusters are zeros and ones
+    if np is not None and len(pulses) >= NUMPY_MIN_PULSES:
+        widths = np.sort(np.asarray(pulses, dtype=np.int64))
+        breaks = (np.flatnonzero(widths[1:] > widths[:-1] * CLUSTER_RATIO) + 1).tolist()
+    else:
+        widths = sorted(pulses)
+        breaks = [i for i, (shorter, longer) in enumerate(zip(widths, widths[1:]), 1) if longer > shorter * CLUSTER_RATIO]
+
+    if not breaks:
+        logging.debug('One pulse cluster, use default thresholds')
+        return DEFAULT_THRESHOLDS
+
+    # A noise spike or a header makes a small cluster of its own, the shorter one wins a tie
+    bounds = [0] + breaks + [len(widths)]
+    clusters = [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    zero, one = sorted(sorted(clusters, key=lambda cluster: cluster[1] - cluster[0], reverse=True)[:2])
+
+    # Cut in the middle between zeros and ones and between ones and the next cluster
+    zero_max = (int(widths[zero[1] - 1]) + int(widths[one[0]])) // 2
+
+    if one[1] < len(widths):
+        one_max = (int(widths[one[1] - 1]) + int(widths[one[1]]) + 1) // 2
+    else:
+        one_max = int(widths[-1]) * 2
+
+    middle = int(widths[(one[0] + one[1]) // 2])
+    one_max = min(one_max, int(middle * (1 + ONE_TOLERANCE)) + 1)
+
+    return (zero_max, one_max)
+
+def compress_pulses(pulses, tokens, thresholds):
+    # Returns the pre data and the data items of a compressed signal
+    if np is not None and len(pulses) >= NUMPY_MIN_PULSES:
+        data, zeros, ones = _compress_numpy(pulses, tokens, thresholds)
+    else:
+        data, zeros, ones = _compress_python(pulses, tokens, thresholds)
+
+    pre_data = [str(round(zeros[0] / zeros[1])), str(round(ones[0] / ones[1]))]
+
+    return pre_data, data
+
+def _compress_numpy(pulses, tokens, thresholds):
+    runs, zeros, ones = _runs_numpy(pulses, thresholds)
+    data = []
+    compressed = []
+
+    for kind, start, length in runs:
+        if kind == 0:
+            compressed.append('%da' % length)
+        elif kind == 1:
+            compressed.append('%db' % length)
+        else:
+            if compressed:
+                data.append('[%s]' % ''.join(compressed))
+                compressed = []
+
+            data.append(str(MAX_PULSE) if pulses[start] > MAX_PULSE else tokens[start])
+
+    if compressed:
+        data.append('[%s]' % ''.join(compressed))
+
+    return data, zeros, ones
+
+def _runs_numpy(pulses, thresholds):
+    values = np.asarray(pulses, dtype=np.int64)
+    # 0 zero, 1 one, 2 as it is
+    kinds = np.searchsorted(np.array([thresholds[0] + 1, thresholds[1]]), values, side='right')
+    # A run starts where the kind changes, every long pulse is a run of its own
+    changes = kinds == 2
+    changes[0] = True
+    changes[1:] |= kinds[1:] != kinds[:-1]
+    starts = np.flatnonzero(changes).tolist()
+    ends = starts[1:] + [len(kinds)]
+    runs = zip(kinds[starts].tolist(), starts, [end - start for start, end in zip(starts, ends)])
+    # Integer sums stay exact in float64 far beyond any capture
+    sums = np.bincount(kinds, weights=values, minlength=3)
+    counts = np.bincount(kinds, minlength=3)
+
+    return runs, (int(sums[0]), int(counts[0])), (int(sums[1]), int(counts[1]))
+
+def _compress_python(pulses, tokens, thresholds):
+    # One pass like the former loop, runs are written as they end
+    zero_max, one_max = thresholds
+    data = []
+    compressed = []
+    zero_sum = zero_count = one_sum = one_count = 0
+    kind = None
+    count = 0
+
+    for pulse, token in zip(pulses, tokens):
+        if pulse <= zero_max:
+            current = 'a'
+            zero_sum += pulse
+            zero_count += 1
+        elif pulse < one_max:
+            current = 'b'
+            one_sum += pulse
+            one_count += 1
+        else:
+            current = None
+
+        if current != kind:
+            if kind is not None:
+                compressed.append('%d%s' % (count, kind))
+
+            kind = current
+            count = 0
+
+        if current is None:
+            if compressed:
+                data.append('[%s]' % ''.join(compressed))
+                compressed = []
+
+            data.append(str(MAX_PULSE) if pulse > MAX_PULSE else token)
+        else:
+            count += 1
+
+    if kind is not None:
+        compressed.append('%d%s' % (count, kind))
+
+    if compressed:
+        data.append('[%s]' % ''.join(compressed))
+
+    return data, (zero_sum, zero_count), (one_sum, one_count)
@@ -0,0 +1,284 @@
+import logging
+from collections import namedtuple
+
+# A decoded button is sent to the Arduino as "<protocol> <address> <command> <repeat>",
+# address and command in hex, e.g. "nec 4 8 0". Raw compressed signals start with a digit.
+IrCode = namedtuple('IrCode', ['protocol', 'address', 'command', 'repeat'])
+
+# Measured pulses may be this much off, receivers stretch marks a lot
+TOLERANCE = 0.3
+# A space this long ends a frame, repeats follow as more frames
+FRAME_GAP = 10000
+
+NEC_HEADER = (9000, 4500)
+NEC_REPEAT = (9000, 2250, 560)
+NEC_MARK = 560
+NEC_ZERO = 560
+NEC_ONE = 1690
+SONY_HEADER = (2400, 600)
+SONY_ZERO = 600
+SONY_ONE = 1200
+SONY_BITS = {12: 'sony12', 15: 'sony15', 20: 'sony20'}
+RC5_UNIT = 889
+RC6_UNIT = 444
+RC6_HEADER = (2666, 889)
+
+def match(pulse, expected):
+    return abs(pulse - expected) <= expected * TOLERANCE
+
+def split_frames(pulses):
+    # Pulses alternate mark, space, starting with a mark
+    frames = []
+    start = 0
+
+    for i in range(1, len(pulses), 2):
+        if pulses[i] >= FRAME_GAP:
+            frames.append(pulses[start:i])
+            start = i + 1
+
+    frames.append(pulses[start:])
+
+    return [frame for frame in frames if frame]
+
+def decode_signal(pulses):
+    # Returns an IrCode or None when the signal is not a known protocol
+    frames = split_frames(pulses)
+
+    if not frames:
+        return None
+
+    for decoder in [_decode_nec, _decode_sony, _decode_rc5, _decode_rc6]:
+        code = decoder(frames[0])
+
+        if code is None:
+            continue
+
+        repeat = 0
+
+        for frame in frames[1:]:
+            # NEC repeats with a short frame, the others send the whole frame again
+            if decoder(frame) == code or (code.protocol in ['nec', 'necx'] and _is_nec_repeat(frame)):
+                repeat += 1
+            else:
+                logging.debug('Frame %d does not repeat %s' % (repeat + 1, code.protocol))
+                return None
+
+        return code._replace(repeat=repeat)
+
+    return None
+
+def format_code(code):
+    return '%s %x %x %d' % code
+
+def parse_code(message):
+    protocol, address, command, repeat = message.split()
+    return IrCode(protocol, int(address, 16), int(command, 16), int(repeat))
+
+def encode_code(code):
+    # Pulses of a code as the Arduino has to send them, frames separated by FRAME_GAP * 4
+    if code.protocol in ['nec', 'necx']:
+        if code.protocol == 'nec':
+            address = code.address | (code.address ^ 0xff) << 8
+        else:
+            address = code.address
+
+        value = address | code.command << 16 | (code.command ^ 0xff) << 24
+        frame = list(NEC_HEADER) + _pulse_distance(value, 32, NEC_MARK, NEC_ZERO, NEC_ONE)
+        frames = [frame] + [list(NEC_REPEAT)] * code.repeat
+    elif code.protocol in SONY_BITS.values():
+        bits = int(code.protocol[4:])
+        value = code.command | code.address << 7
+        frame = list(SONY_HEADER)
+
+        for i in range(bits):
+            frame += [SONY_ONE if value >> i & 1 else SONY_ZERO, SONY_ZERO]
+
+        frames = [frame[:-1]] * (code.repeat + 1)
+    elif code.protocol == 'rc5':
+        # S1, S2 (inverted command bit 6), toggle, 5 address and 6 command bits
+        bits = [1, 0 if code.command & 0x40 else 1, 0]
+        bits += [code.address >> i & 1 for i in range(4, -1, -1)]
+        bits += [code.command >> i & 1 for i in range(5, -1, -1)]
+        halves = []
+
+        for bit in bits:
+            halves += [0, 1] if bit else [1, 0]
+
+        frames = [_from_halves(halves[1:], RC5_UNIT)] * (code.repeat + 1)
+    elif code.protocol == 'rc6':
+        # Start bit, mode 0, toggle of double width, 8 address and 8 command bits
+        halves = [1, 0, 0, 1, 0, 1, 0, 1, 0, 0, 1, 1]
+        value = code.address << 8 | code.command
+
+        for i in range(15, -1, -1):
+            halves += [1, 0] if value >> i & 1 else [0, 1]
+
+        frames = [list(RC6_HEADER) + _from_halves(halves, RC6_UNIT)] * (code.repeat + 1)
+    else:
+        raise ValueError('Unknown IR protocol: %s' % code.protocol)
+
+    pulses = []
+
+    for frame in frames:
+        if pulses:
+            pulses.append(FRAME_GAP * 4)
+
+        pulses += frame
+
+    return pulses
+
+def _pulse_distance(value, bits, mark, zero, one):
+    pulses = []
+
+    for i in range(bits):
+        pulses += [mark, one if value >> i & 1 else zero]
+
+    return pulses + [mark]
+
+def _from_halves(halves, unit):
+    # Merges neighbouring half bits of the same level into pulses, trailing spaces are idle
+    while halves and halves[-1] == 0:
+        halves = halves[:-1]
+
+    pulses = []
+    level = None
+
+    for half in halves:
+        if half == level:
+            pulses[-1] += unit
+        else:
+            pulses.append(unit)
+            level = half
+
+    return pulses
+
+def _to_halves(frame, unit, max_units):
+    # Mark and space levels of every unit, None when a pulse is not a whole number of units
+    halves = []
+
+    for i, pulse in enumerate(frame):
+        units = int(round(pulse / unit))
+
+        if units < 1 or units > max_units or not match(pulse, units * unit):
+            return None
+
+        halves += [1 - i % 2] * units
+
+    return halves
+
+def _decode_nec(frame):
+    if len(frame) != 67 or not (match(frame[0], NEC_HEADER[0]) and match(frame[1], NEC_HEADER[1])):
+        return None
+
+    value = 0
+
+    for i in range(32):
+        mark, space = frame[2 + i * 2], frame[3 + i * 2]
+
+        if not match(mark, NEC_MARK):
+            return None
+
+        if match(space, NEC_ONE):
+            value |= 1 << i
+        elif not match(space, NEC_ZERO):
+            return None
+
+    address = value & 0xffff
+    command = value >> 16 & 0xff
+
+    if value >> 24 != command ^ 0xff:
+        return None
+
+    # Extended NEC uses the inverted address byte for 8 more address bits
+    if address >> 8 == (address & 0xff) ^ 0xff:
+        return IrCode('nec', address & 0xff, command, 0)
+
+    return IrCode('necx', address, command, 0)
+
+def _is_nec_repeat(frame):
+    return len(frame) == 3 and all(match(pulse, expected) for pulse, expected in zip(frame, NEC_REPEAT))
+
+def _decode_sony(frame):
+    # Header, then a mark and a space per bit, the last space is the gap
+    bits = (len(frame) - 1) // 2
+
+    if bits not in SONY_BITS or len(frame) != bits * 2 + 1:
+        return None
+
+    if not (match(frame[0], SONY_HEADER[0]) and match(frame[1], SONY_HEADER[1])):
+        return None
+
+    value = 0
+
+    for i in range(bits):
+        if match(frame[2 + i * 2], SONY_ONE):
+            value |= 1 << i
+        elif not match(frame[2 + i * 2], SONY_ZERO):
+            return None
+
+        if i < bits - 1 and not match(frame[3 + i * 2], SONY_ZERO):
+            return None
+
+    return IrCode(SONY_BITS[bits], value >> 7, value & 0x7f, 0)
+
+def _decode_rc5(frame):
+    halves = _to_halves(frame, RC5_UNIT, 2)
+
+    if halves is None:
+        return None
+
+    # The space half of the first start bit looks like idle
+    halves = [0] + halves
+    halves += [0] * (28 - len(halves))
+
+    if len(halves) != 28:
+        return None
+
+    bits = []
+
+    for i in range(0, 28, 2):
+        if halves[i:i + 2] == [0, 1]:
+            bits.append(1)
+        elif halves[i:i + 2] == [1, 0]:
+            bits.append(0)
+        else:
+            return None
+
+    address = int(''.join(str(bit) for bit in bits[3:8]), 2)
+    command = int(''.join(str(bit) for bit in bits[8:14]), 2)
+
+    # RC5X: the second start bit is the inverted command bit 6
+    if bits[1] == 0:
+        command |= 0x40
+
+    return IrCode('rc5', address, command, 0)
+
+def _decode_rc6(frame):
+    if len(frame) < 3 or not (match(frame[0], RC6_HEADER[0]) and match(frame[1], RC6_HEADER[1])):
+        return None
+
+    halves = _to_halves(frame[2:], RC6_UNIT, 3)
+
+    if halves is None:
+        return None
+
+    halves += [0] * (44 - len(halves))
+
+    # Start bit 1, mode 0, the toggle bit takes 4 units
+    if len(halves) != 44 or halves[:8] != [1, 0, 0, 1, 0, 1, 0, 1]:
+        return None
+
+    if halves[8:12] not in ([1, 1, 0, 0], [0, 0, 1, 1]):
+        return None
+
+    value = 0
+
+    for i in range(12, 44, 2):
+        if halves[i:i + 2] == [1, 0]:
+            value = value << 1 | 1
+        elif halves[i:i + 2] == [0, 1]:
+            value = value << 1
+        else:
+            return None
+
+    return IrCode('rc6', value >> 8, value & 0xff, 0)
@@ -0,0 +1,169 @@
+# A packed signal is the compressed text as bytes:
+#   MARKER, varint zero and one averages, varint header pulses,
+#   then segments: varint(pulse << 1) for a raw pulse or
+#   varint(count << 1 | 1) and count mark/space bits, 8 per byte, LSB first.
+# Bytes the Arduino reads as line or packet ends are escaped with ESCAPE, byte ^ 0x20.
+MARKER = 0x02
+ESCAPE = 0x1b
+RESERVED = (0x0a, 0x17, ESCAPE)
+
+def encode_packed(compressed):
+    # compressed is compress_signal output, ValueError if it does not pack losslessly
+    tokens = compressed.rstrip('\n').split(' ')
+
+    if len(tokens) < 4:
+        raise ValueError('Too short for a compressed signal')
+
+    data = bytearray([MARKER])
+
+    for token in tokens[:4]:
+        _put_varint(data, _to_int(token))
+
+    for token in tokens[4:]:
+        if token[:1] == '[' and token[-1:] == ']':
+            bits = _expand_runs(token[1:-1])
+            _put_varint(data, len(bits) << 1 | 1)
+            packed = bytearray((len(bits) + 7) // 8)
+
+            for i, bit in enumerate(bits):
+                if bit:
+                    packed[i >> 3] |= 1 << (i & 7)
+
+            data += packed
+        else:
+            _put_varint(data, _to_int(token) << 1)
+
+    packed = _escape(data)
+
+    # Only canonical input comes back the same
+    if decode_packed(packed) != compressed.rstrip('\n'):
+        raise ValueError('Signal does not pack losslessly')
+
+    return packed
+
+def decode_packed(packed):
+    # Returns the compressed text without the trailing new line, a raw new line never is data
+    data = _unescape(packed.rstrip('\n'))
+
+    if not data or data[0] != MARKER:
+        raise ValueError('Not a packed signal')
+
+    offset = 1
+    tokens = []
+
+    for i in range(4):
+        value, offset = _get_varint(data, offset)
+        tokens.append(str(value))
+
+    while offset < len(data):
+        value, offset = _get_varint(data, offset)
+
+        if value & 1:
+            count = value >> 1
+            size = (count + 7) // 8
+
+            if offset + size > len(data):
+                raise ValueError('Truncated packed signal')
+
+            bits = [data[offset + (i >> 3)] >> (i & 7) & 1 for i in range(count)]
+            offset += size
+            tokens.append('[%s]' % _collapse_runs(bits))
+        else:
+            tokens.append(str(value >> 1))
+
+    return ' '.join(tokens)
+
+def is_packed(message):
+    return message[:1] == chr(MARKER)
+
+def _to_int(token):
+    value = int(token)
+
+    if value < 0 or str(value) != token:
+        raise ValueError('Not a canonical pulse: %r' % token)
+
+    return value
+
+def _expand_runs(runs):
+    bits = []
+    count = ''
+
+    for char in runs:
+        if char.isdigit():
+            count += char
+        elif char in 'ab' and count:
+            bits += [0 if char == 'a' else 1] * int(count)
+            count = ''
+        else:
+            raise ValueError('Broken runs: %r' % runs)
+
+    if count:
+        raise ValueError('Broken runs: %r' % runs)
+
+    return bits
+
+def _collapse_runs(bits):
+    runs = []
+    start = 0
+
+    for i in range(1, len(bits) + 1):
+        if i == len(bits) or bits[i] != bits[start]:
+            runs.append('%d%s' % (i - start, 'b' if bits[start] else 'a'))
+            start = i
+
+    return ''.join(runs)
+
+def _put_varint(data, value):
+    while value > 0x7f:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+
+    data.append(value)
+
+def _get_varint(data, offset):
+    value = 0
+    shift = 0
+
+    while True:
+        if offset >= len(data):
+            raise ValueError('Truncated varint')
+
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return value, offset
+
+def _escape(data):
+    # Text with one char per byte, the frame is encoded as latin-1
+    escaped = bytearray()
+
+    for byte in data:
+        if byte in RESERVED:
+            escaped.append(ESCAPE)
+            escaped.append(byte ^ 0x20)
+        else:
+            escaped.append(byte)
+
+    return escaped.decode('latin-1')
+
+def _unescape(packed):
+    data = packed.encode('latin-1')
+    unescaped = bytearray()
+    escape = False
+
+    for byte in data:
+        if escape:
+            unescaped.append(byte ^ 0x20)
+            escape = False
+        elif byte == ESCAPE:
+            escape = True
+        else:
+            unescaped.append(byte)
+
+    if escape:
+        raise ValueError('Truncated escape')
+
+    return unescaped
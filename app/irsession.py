@@ -0,0 +1,66 @@
+import threading, math, logging
+from .ircapture import IrCapture, merge_frames
+from app import helper
+
+class IrSession(threading.Thread):
+
+    def __init__(self, app, backend, frames = 1, start_timeout = 15, repeat_timeout = 3):
+        threading.Thread.__init__(self)
+        self.app = app
+        self.backend = backend
+        self.frames = frames
+        self.start_timeout = start_timeout
+        # Later presses of the same key have to come sooner
+        self.repeat_timeout = repeat_timeout
+
+    def run(self):
+        try:
+            self.capture()
+        except Exception as e:
+            logging.exception('IR capture failed')
+            self.app.sendMessage({'type': 'ir', 'result': 'error', 'message': 'capture failed'})
+
+    def capture(self):
+        capture = IrCapture(self.backend, start_timeout=self.start_timeout)
+        frames = []
+
+        for i in range(self.frames):
+            pulses = capture.capture()
+
+            if pulses is None:
+                break
+
+            frames.append(pulses)
+            capture.start_timeout = self.repeat_timeout
+
+            # Only servers that negotiated ir_frames know the progress messages
+            if self.frames > 1 and 'ir_frames' in self.app.capabilities:
+                self.app.sendMessage({
+                    'type': 'ir_progress',
+                    'result': 'success',
+                    'frame': len(frames),
+                    'frames': self.frames,
+                    'pulses': len(pulses)
+                })
+
+        if not frames:
+            logging.warning('No IR signal')
+            self.app.sendMessage({'type': 'ir', 'result': 'error', 'message': 'timeout'})
+            return
+
+        template, variance, used = merge_frames(frames)
+        deviation = math.sqrt(sum(variance) / len(variance))
+        logging.info('IR template from %d of %d frames, %d pulses, deviation %.1f us' % (
+            used, len(frames), len(template), deviation))
+
+        signal = ' '.join(str(pulse) for pulse in template)
+        ir_signal = helper.pack_signal(signal, self.app.ir_codes, self.app.ir_packed)
+        message = {'type': 'ir', 'result': 'success', 'ir_signal': ir_signal}
+
+        if 'ir_frames' in self.app.capabilities:
+            # Standard deviation per template pulse in us, the server can judge the capture
+            message['frames'] = used
+            message['deviation'] = round(deviation, 1)
+            message['pulse_deviation'] = [int(round(math.sqrt(value))) for value in variance]
+
+        self.app.sendMessage(message)
@@ -60,7 +60,7 @@ class Node(Base):
     host_name = Column(String(100))
     order = Column(Integer)
     timestamp = Column(DateTime)
-    arduinos = relationship('Arduino', backref = 'node', lazy = 'dynamic')
+    arduinos = relationship('Arduino', backref = 'node')
 
     def __repr__(self):
         return '<Node (id=%r, name=%s)>' % (self.id, self.name)
@@ -74,7 +74,7 @@ class Arduino(Base):
     name = Column(String(50))
     order = Column(Integer)
     timestamp = Column(DateTime)
-    radios = relationship('Radio', backref = 'arduino', lazy = 'dynamic')
+    radios = relationship('Radio', backref = 'arduino')
 
     def __repr__(self):
         return '<Arduino (id=%r, name=%s, usb=%s)>' % (self.id, self.name, self.usb)
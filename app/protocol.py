@@ -0,0 +1,126 @@
+import struct, json
+
+# Frame header: message type and payload length
+HEADER = struct.Struct('>BI')
+
+MSG_JSON = 1
+MSG_PUSH_BUTTON = 2
+MSG_EVENT = 3
+# Event batches are sent as MSG_JSON, json.dumps in C beats packing every event, still decoded
+MSG_EVENTS = 4
+MSG_IR = 5
+
+PUSH_BUTTON = struct.Struct('>II')
+COUNT = struct.Struct('>H')
+
+def encode_message(message):
+    # Hot messages get a compact layout, everything else is JSON in a frame
+    try:
+        frame = _encode_compact(message)
+    except (ValueError, struct.error):
+        # A field does not fit the compact layout
+        frame = None
+
+    if frame is None:
+        payload = json.dumps(message, separators=(',', ':')).encode()
+        frame = HEADER.pack(MSG_JSON, len(payload)) + payload
+
+    return frame
+
+def _encode_compact(message):
+    if _is_push_button(message):
+        payload = PUSH_BUTTON.pack(message['button_id'], message['user_id'])
+        return HEADER.pack(MSG_PUSH_BUTTON, len(payload)) + payload
+    elif _is_event(message):
+        payload = _encode_event(message)
+        return HEADER.pack(MSG_EVENT, len(payload)) + payload
+    elif message.get('type') == 'ir' and message.get('result') == 'success' \
+            and isinstance(message.get('ir_signal'), str) and len(message) == 3:
+        payload = message['ir_signal'].encode()
+        return HEADER.pack(MSG_IR, len(payload)) + payload
+
+    return None
+
+def decode_message(message_type, payload):
+    if message_type == MSG_JSON:
+        return json.loads(bytes(payload).decode())
+    elif message_type == MSG_PUSH_BUTTON:
+        button_id, user_id = PUSH_BUTTON.unpack(payload)
+        return {'event': 'pushButton', 'button_id': button_id, 'user_id': user_id}
+    elif message_type == MSG_EVENT:
+        event, offset = _decode_event(payload, 0)
+        return event
+    elif message_type == MSG_EVENTS:
+        count, = COUNT.unpack_from(payload, 0)
+        offset = COUNT.size
+        events = []
+
+        for i in range(count):
+            event, offset = _decode_event(payload, offset)
+            events.append(event)
+
+        return {'type': 'events', 'result': 'success', 'events': events}
+    elif message_type == MSG_IR:
+        return {'type': 'ir', 'result': 'success', 'ir_signal': bytes(payload).decode()}
+
+    raise ValueError('Unknown message type: %r' % message_type)
+
+def _is_push_button(message):
+    return message.get('event') == 'pushButton' and len(message) == 3 \
+        and isinstance(message.get('button_id'), int) and isinstance(message.get('user_id'), int)
+
+def _is_event(message):
+    return message.get('type') == 'event' and message.get('result') == 'success' and len(message) == 5 \
+        and isinstance(message.get('message'), dict) and 0 <= message.get('radio_pipe', -1) <= 255
+
+def _encode_event(event):
+    # port, pipe, field names joined by commas, a kind byte per field,
+    # then all numbers as one packed run of doubles and the strings last
+    port = event['port'].encode()
+    message = event['message']
+    names = ','.join(message).encode()
+    kinds = bytes(0x64 if isinstance(message[key], float) else 0x73 for key in message)
+    numbers = [value for value in message.values() if isinstance(value, float)]
+    parts = [bytes([len(port)]), port, bytes([event['radio_pipe'], len(message), len(names)]), names, kinds]
+    parts.append(struct.pack('>%dd' % len(numbers), *numbers))
+
+    for value in message.values():
+        if not isinstance(value, float):
+            value = str(value).encode()
+            parts.append(bytes([len(value)]))
+            parts.append(value)
+
+    return b''.join(parts)
+
+def _decode_event(payload, offset):
+    size = payload[offset]
+    port = bytes(payload[offset + 1:offset + 1 + size]).decode()
+    offset += 1 + size
+    radio_pipe, count, size = payload[offset], payload[offset + 1], payload[offset + 2]
+    offset += 3
+    names = bytes(payload[offset:offset + size]).decode().split(',') if count else []
+    offset += size
+    kinds = payload[offset:offset + count]
+    offset += count
+    floats = kinds.count(0x64)
+    numbers = iter(struct.unpack_from('>%dd' % floats, payload, offset))
+    offset += floats * 8
+    message = {}
+
+    for name, kind in zip(names, kinds):
+        if kind == 0x64:
+            message[name] = next(numbers)
+        else:
+            size = payload[offset]
+            message[name] = bytes(payload[offset + 1:offset + 1 + size]).decode()
+            offset += 1 + size
+
+    event = {
+        'type': 'event',
+        'result': 'success',
+        'port': port,
+        'message': message,
+        'radio_pipe': radio_pipe
+    }
+
+    return event, offset
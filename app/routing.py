@@ -0,0 +1,56 @@
+import logging
+from collections import namedtuple
+from .irpack import is_packed
+
+Route = namedtuple('Route', ['button_id', 'usb', 'radio_pipe', 'frame', 'driver', 'on_request', 'expired_after'])
+
+class RoutingTable():
+
+    def __init__(self):
+        self.routes = {}
+
+    def load(self, config, ads):
+        routes = {}
+
+        for arduino in config.arduinos:
+            for radio in arduino.radios:
+                try:
+                    pipe = chr(int(radio.pipe))
+                except (TypeError, ValueError, OverflowError):
+                    logging.warning('Radio %r has a bad pipe: %r' % (radio.id, radio.pipe))
+                    continue
+
+                for button in radio.buttons:
+                    if button.message is None:
+                        logging.warning('Button %r has no message' % button.id)
+                        continue
+
+                    frame = '%s%s\n' % (pipe, button.message)
+
+                    routes[button.id] = Route(
+                        button_id=button.id,
+                        usb=arduino.usb,
+                        radio_pipe=radio.pipe,
+                        # Packed IR signals hold one byte per char
+                        frame=frame.encode('latin-1') if is_packed(button.message) else frame.encode(),
+                        driver=ads.get(arduino.usb),
+                        on_request=radio.on_request == 1,
+                        expired_after=radio.expired_after)
+
+        changed = len([button_id for button_id in routes if self.routes.get(button_id) != routes[button_id]])
+        changed += len(set(self.routes) - set(routes))
+
+        # Swap the whole table at once, readers never see a partial one
+        self.routes = routes
+        logging.info('Loaded %d routes, %d changed' % (len(routes), changed))
+
+        return changed
+
+    def clear(self):
+        self.routes = {}
+
+    def getRoute(self, button_id):
+        try:
+            return self.routes.get(int(button_id))
+        except (TypeError, ValueError):
+            return None
@@ -1,9 +1,7 @@
-import threading, socket, sys, json, time, logging
-from .models import Node, Arduino, Button, Radio
+import threading, socket, struct, sys, json, time, logging
 from .drivers import ArduinoQueueItem
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app import helper
+from .stream import FrameReader, LengthFrameReader
+from .protocol import decode_message
 
 class DiscoverCatcher:
 
@@ -37,34 +35,31 @@ class RpiNode:
         logging.info('Configure arduinos')
         logging.info('Debug: %r' % self.app.debug)
         
-        if self.app.createArduinoDrivers() == False:
+        # Drivers outlive the server connection, only the first session creates them
+        if self.app.status != 'started' and self.app.createArduinoDrivers(prefer_snapshot=True) == False:
             logging.error('The node not found in DB')
             self.app.sock.close()
             return
 
         try:
             logging.info('Strat listening')
-            message_buff = ''
-
-            while True:
-                data = self.app.sock.recv(1)
-                
-                if data:
-                    udata = data.decode()
-
-                    if udata != "\n":
-                        message_buff += udata
-                        continue
-
-                    parser = EventParser(message_buff, self.app)
-                    parser.start()
-                    message_buff = ''
-                else:
-                    logging.warning('Connection closed, empty response')
-                    for arduino in self.app.ads:
-                        self.app.ads[arduino].close()
-                    self.app.sock.close()
-                    break
+            if 'bin' in self.app.capabilities:
+                reader = LengthFrameReader(self.app.sock)
+            else:
+                reader = FrameReader(self.app.sock)
+
+            for message in reader.frames():
+                parser = EventParser(message, self.app)
+
+                if parser.parse():
+                    self.app.dispatcher.submit(parser.getKey(), parser.run)
+
+            logging.warning('Connection closed, empty response')
+            self.app.sock.close()
+
+        except OSError as e:
+            logging.warning('Connection lost: %s' % e)
+            self.app.sock.close()
 
         except KeyboardInterrupt:
             self.app.interrupt = True
@@ -74,33 +69,57 @@ class RpiNode:
             self.app.interrupt = True
             logging.exception('Main thread error')
         
-class EventParser(threading.Thread):
+class EventParser():
 
     def __init__(self, udata, app):
-        threading.Thread.__init__(self)
         self.udata = udata
         self.app = app
+        self.data = None
 
-    def run(self):
+    def parse(self):
         try:
-            data = json.loads(self.udata)
-        except ValueError as e:
+            if isinstance(self.udata, tuple):
+                # Binary framing: (type, payload)
+                self.data = decode_message(*self.udata)
+            else:
+                self.data = json.loads(self.udata.decode('utf-8', 'replace'))
+        except (ValueError, IndexError, struct.error) as e:
             logging.debug(self.udata)
-            logging.exception('Broken json from socket')
-            return
+            logging.exception('Broken message from socket')
+            return False
+
+        if not isinstance(self.data, dict):
+            logging.warning('Unexpected message: %s' % self.udata)
+            return False
+
+        return True
+
+    def getKey(self):
+        # Events with the same key are executed in order
+        event = self.data.get('event')
+
+        if event in ['start', 'stop', 'restart']:
+            return 'system'
+        elif event == 'catchIr':
+            return 'ir'
+        elif event == 'pushButton':
+            route = self.app.routing.getRoute(self.data.get('button_id'))
+
+            if route is not None:
+                return 'pipe:%s:%s' % (route.usb, route.radio_pipe)
+
+        return None
+
+    def run(self):
+        data = self.data
 
         # Stop listenning Arduinos
         if self.app.status == 'started' and 'event' in data and data['event'] == 'stop':
             logging.info('Try to stop service')
-            self.app.status == 'stopping'
-
-            for arduino in self.app.ads:
-                self.app.ads[arduino].close()
-
-            time.sleep(2)
+            self.app.status = 'stopping'
+            elapsed = self.app.closeArduinoDrivers()
             self.app.status = 'stopped'
-            response = "%s\n" % json.dumps({'type': 'system', 'result': 'success', 'service': 'stopped'})
-            self.app.sock.send(response.encode())
+            self.app.sendMessage({'type': 'system', 'result': 'success', 'service': 'stopped', 'elapsed_ms': round(elapsed * 1000, 1)})
 
         # Start listenning Arduinos
         elif self.app.status == 'stopped' and 'event' in data and data['event'] == 'start':
@@ -109,67 +128,55 @@ class EventParser(threading.Thread):
                 logging.error('The node not found in DB')
                 self.app.sock.close()
 
-            response = "%s\n" % json.dumps({'type': 'system', 'result': 'success', 'service': 'started'})
-            self.app.sock.send(response.encode())
+            self.app.sendMessage({'type': 'system', 'result': 'success', 'service': 'started'})
 
         # Restart listenning Arduinos
         elif self.app.status == 'started' and 'event' in data and data['event'] == 'restart':
             logging.info('Try to restart service')
-            self.app.status == 'restarting'
-
-            for arduino in self.app.ads:
-                self.app.ads[arduino].close()
+            started_at = time.time()
+            # Only the difference to the running config is applied
+            config = self.app.loadConfig()
 
-            time.sleep(2)
-
-            if self.app.createArduinoDrivers() == False:
+            if config is None:
                 logging.error('The node not found in DB')
                 self.app.sock.close()
+            else:
+                self.app.applyConfig(config)
 
-            response = "%s\n" % json.dumps({'type': 'system', 'result': 'success', 'service': 'restarted'})
-            self.app.sock.send(response.encode())
+            elapsed = time.time() - started_at
+            logging.info('Restarted in %.1f ms' % (elapsed * 1000))
+            self.app.sendMessage({'type': 'system', 'result': 'success', 'service': 'restarted', 'elapsed_ms': round(elapsed * 1000, 1)})
             
         elif self.app.status == 'started' and 'event' in data and data['event'] == 'pushButton':
             self.pushButton(data)
 
         elif self.app.status == 'started' and 'event' in data and data['event'] == 'catchIr':
             logging.info(data['host_name'])
-            ir_signal = helper.read_signal()
-            ir_signal = helper.compress_signal(ir_signal)
-            response = "%s\n" % json.dumps({'type': 'ir', 'result': 'success', 'ir_signal': ir_signal})
-            self.app.sock.send(response.encode())
+
+            # The result follows from the capture thread
+            if not self.app.startIrSession(data.get('frames', self.app.ir_frames)):
+                self.app.sendMessage({'type': 'ir', 'result': 'error', 'message': 'busy'})
+
+        # Queue, pool and link counters, answered in any service state
+        elif 'event' in data and data['event'] == 'stats':
+            self.app.sendMessage({'type': 'stats', 'result': 'success', 'stats': self.app.getStats()})
 
     def pushButton(self, data):
-        session = self.app.createSession()
-        button = session.query(Button).get(data['button_id'])
-        radio = session.query(Radio).get(button.radio_id)
-        arduino = radio.arduino
-        # button, arduino, radio = session.query(Radio).filter(Button.id == data['button_id']).first()
-        session.close()
-
-        # Debug
-        # logging.info(str(button))
-        # logging.info(str(button.execute))
-
-        if arduino is not None and radio is not None:
-            if arduino.usb in self.app.ads:
-                props = {
-                    'radio_pipe': radio.pipe,
-                    'radio_type': radio.type,
-                    'message': button.message,
-                    'user_id': data['user_id']
-                }
-
-                # pre_data.append('%si' % chr(self.props['radio_pipe']))
-                full_message = '%s%s\n' % (chr(int(radio.pipe)), button.message)
-                
-                if radio.on_request == 1:
-                    item = ArduinoQueueItem(full_message, 1)
-                    item.setExpiration(radio.expired_after)
-                    item.setRadioPipe(radio.pipe)
-                    self.app.ads[arduino.usb].addToRequestBuffer(item)
-                else:
-                    item = ArduinoQueueItem(full_message, 2)
-                    self.app.ads[arduino.usb].addToQueue(item)
-        else:
+        route = self.app.routing.getRoute(data['button_id'])
+
+        if route is None:
             logging.warning('Bad settings')
+            return
+
+        if route.driver is None:
+            logging.warning('Arduino %s is %s' % (route.usb, self.app.port_status.get(route.usb, 'not opened')))
+            return
+
+        if route.on_request:
+            item = ArduinoQueueItem(route.frame, 1)
+            item.setExpiration(route.expired_after)
+            item.setRadioPipe(route.radio_pipe)
+            route.driver.addToRequestBuffer(item)
+        else:
+            item = ArduinoQueueItem(route.frame, 2)
+            route.driver.addToQueue(item)
@@ -0,0 +1,247 @@
+import threading, collections, time, logging
+from .protocol import HEADER
+
+class FrameReader():
+
+    def __init__(self, sock, max_frame = 65536, delimiter = b'\n'):
+        self.sock = sock
+        self.max_frame = max_frame
+        self.delimiter = delimiter
+        self.buffer = bytearray(max_frame)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.discarding = False
+        self.oversized = 0
+
+    def frames(self):
+        # Yields complete frames without the delimiter, returns when the peer closes
+        while True:
+            if self.start > 0:
+                # Move the partial frame to the head of the buffer
+                size = self.end - self.start
+                self.view[:size] = self.view[self.start:self.end]
+                self.start = 0
+                self.end = size
+
+            if self.end == self.max_frame:
+                logging.warning('Frame is longer than %d bytes, dropped' % self.max_frame)
+                self.oversized += 1
+                self.discarding = True
+                self.end = 0
+
+            received = self.sock.recv_into(self.view[self.end:])
+
+            if not received:
+                return
+
+            scan = self.end
+            self.end += received
+
+            while True:
+                pos = self.buffer.find(self.delimiter, scan, self.end)
+
+                if pos < 0:
+                    break
+
+                if self.discarding:
+                    # Tail of an oversized frame
+                    self.discarding = False
+                else:
+                    yield bytes(self.view[self.start:pos])
+
+                self.start = pos + len(self.delimiter)
+                scan = self.start
+
+            if self.discarding:
+                self.start = self.end
+
+class SocketWriter(threading.Thread):
+
+    def __init__(self, max_commands = 256, max_telemetry = 1024, max_batch = 65536):
+        threading.Thread.__init__(self)
+        self.is_running = True
+        self.sock = None
+        self.condition = threading.Condition()
+        # Command results are never dropped, producers wait when the queue is full
+        self.commands = collections.deque()
+        self.max_commands = max_commands
+        # Telemetry drops the oldest frames when the queue is full
+        self.telemetry = collections.deque()
+        self.max_telemetry = max_telemetry
+        self.max_batch = max_batch
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.stats_bytes = 0
+        self.stats_at = time.time()
+
+    def attach(self, sock):
+        with self.condition:
+            self.sock = sock
+            self.condition.notify_all()
+
+    def detach(self):
+        with self.condition:
+            self.sock = None
+
+    def send(self, frame, telemetry = False):
+        with self.condition:
+            if telemetry:
+                if len(self.telemetry) >= self.max_telemetry:
+                    self.telemetry.popleft()
+                    self.dropped += 1
+
+                self.telemetry.append(frame)
+            else:
+                while len(self.commands) >= self.max_commands and self.is_running:
+                    self.condition.wait()
+
+                self.commands.append(frame)
+
+            self.condition.notify_all()
+
+    def drain(self, timeout):
+        # Waits until the queued frames are taken for sending, False if the socket went away or time ran out
+        deadline = time.time() + timeout
+
+        with self.condition:
+            while self.sock is not None and (self.commands or self.telemetry):
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    break
+
+                self.condition.wait(remaining)
+
+            return not (self.commands or self.telemetry)
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.is_running and (self.sock is None or not (self.commands or self.telemetry)):
+                    self.condition.wait()
+
+                # Terminate the process
+                if not self.is_running:
+                    logging.info('Stop SocketWriter')
+                    break
+
+                sock = self.sock
+                commands, batch = self.takeBatch()
+                # Producers blocked on a full command queue can go on
+                self.condition.notify_all()
+
+            try:
+                sock.sendall(batch)
+            except Exception as e:
+                logging.exception('Could not send %d bytes' % len(batch))
+
+                with self.condition:
+                    # Command results go out again on the next socket, telemetry is stale anyway
+                    self.commands.extendleft(reversed(commands))
+
+                    # The app may have attached a new socket meanwhile
+                    if self.sock is sock:
+                        self.sock = None
+
+                continue
+
+            with self.condition:
+                self.bytes_sent += len(batch)
+
+    def takeBatch(self):
+        # Command results go first, then telemetry, coalesced into one sendall
+        frames = []
+        size = 0
+
+        commands = 0
+
+        for frames_queue in [self.commands, self.telemetry]:
+            while frames_queue and (not frames or size + len(frames_queue[0]) <= self.max_batch):
+                frame = frames_queue.popleft()
+                frames.append(frame)
+                size += len(frame)
+
+            if frames_queue is self.commands:
+                commands = len(frames)
+
+        # The command frames are kept to requeue them when the send fails
+        return frames[:commands], b''.join(frames)
+
+    def getStats(self):
+        with self.condition:
+            now = time.time()
+            bytes_per_sec = (self.bytes_sent - self.stats_bytes) / max(now - self.stats_at, 0.001)
+            self.stats_bytes = self.bytes_sent
+            self.stats_at = now
+
+            return {
+                'commands': len(self.commands),
+                'telemetry': len(self.telemetry),
+                'dropped': self.dropped,
+                'bytes': self.bytes_sent,
+                'bytes_per_sec': bytes_per_sec
+            }
+
+class LengthFrameReader():
+
+    def __init__(self, sock, max_frame = 65536):
+        self.sock = sock
+        self.max_frame = max_frame
+        self.buffer = bytearray(max_frame + HEADER.size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # Bytes left of an oversized frame
+        self.skip = 0
+        self.oversized = 0
+
+    def frames(self):
+        # Yields (type, payload) tuples, returns when the peer closes
+        while True:
+            if self.start > 0:
+                # Move the partial frame to the head of the buffer
+                size = self.end - self.start
+                self.view[:size] = self.view[self.start:self.end]
+                self.start = 0
+                self.end = size
+
+            received = self.sock.recv_into(self.view[self.end:])
+
+            if not received:
+                return
+
+            self.end += received
+
+            while True:
+                if self.skip:
+                    dropped = min(self.skip, self.end - self.start)
+                    self.skip -= dropped
+                    self.start += dropped
+
+                    if self.skip:
+                        break
+
+                if self.end - self.start < HEADER.size:
+                    break
+
+                message_type, length = HEADER.unpack_from(self.buffer, self.start)
+
+                if length > self.max_frame:
+                    logging.warning('Frame is longer than %d bytes, dropped' % self.max_frame)
+                    self.oversized += 1
+                    self.start += HEADER.size
+                    self.skip = length
+                    continue
+
+                if self.end - self.start < HEADER.size + length:
+                    break
+
+                payload_start = self.start + HEADER.size
+                yield message_type, bytes(self.view[payload_start:payload_start + length])
+                self.start = payload_start + length
@@ -0,0 +1,73 @@
+import threading, queue, time, logging
+from .drivers import typed_values
+
+class TelemetryBatcher(threading.Thread):
+
+    def __init__(self, app, interval = 0.5, batch_size = 32):
+        threading.Thread.__init__(self)
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.events = queue.Queue()
+        self.is_running = True
+
+    def addPackage(self, package):
+        message = package.getMessage()
+
+        # Sensor values stay the strings the Arduino sent unless the server takes numbers
+        if 'typed' in self.app.capabilities:
+            message = typed_values(message)
+
+        self.events.put({
+            'type': 'event',
+            'result': 'success',
+            'port': package.getSerialPort(),
+            'message': message,
+            'radio_pipe': package.getRadioPipeOrd()
+        })
+
+    def stop(self):
+        self.is_running = False
+        # Unblocks a waiting get()
+        self.events.put(None)
+
+    def run(self):
+        batch = []
+        deadline = None
+
+        while True:
+            # Terminate the process
+            if self.is_running == False:
+                if batch:
+                    self.flush(batch)
+
+                logging.info('Stop TelemetryBatcher')
+                break
+
+            timeout = max(deadline - time.time(), 0) if batch else None
+
+            try:
+                event = self.events.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+
+            if event is not None:
+                if not batch:
+                    deadline = time.time() + self.interval
+
+                batch.append(event)
+
+            if not batch:
+                continue
+
+            # Old servers get every event on its own right away
+            if 'batch' not in self.app.capabilities or len(batch) >= self.batch_size or time.time() >= deadline:
+                self.flush(batch)
+                batch = []
+
+    def flush(self, batch):
+        if 'batch' in self.app.capabilities:
+            self.app.sendMessage({'type': 'events', 'result': 'success', 'events': batch}, telemetry=True)
+        else:
+            for event in batch:
+                self.app.sendMessage(event, telemetry=True)
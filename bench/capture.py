@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Compares CPU use and accuracy of the former GPIO polling loop with the edge capture engine
+# Run from the repository root: python3 -m bench.capture
+import time, random, logging
+from datetime import datetime
+from app import helper
+from app.ircapture import IrCapture, ReplayBackend, merge_frames
+from app.ircompress import DEFAULT_THRESHOLDS
+
+SIGNAL = [int(pulse) for pulse in "8851 4435 565 1644 591 512 568 565 566 540 567 1642 568 565 567 1644 592 539 540 565 592 1623 592 1647 594 511 589 1650 562 1646 593 1643 594 513 595 511 590 516 565 569 592 510 595 1615 570 564 592 514 593 513 566 565 541 567 591 515 592 513 567 565 541 565 592 515 565 565 541 565 591 517 564 541 590 515 591 541 591 1619 568 564 538 568 566 539 591 513 592 543 561 545 589 516 593 512 565 567 565 539 566 1644 565 567 593 1618 593 1643 594 515 590 514 565 1675 589 514 593".split()]
+LEAD_IN = 0.2
+
+class FakeGPIO():
+    # Level of a replayed signal at the current time, 1 is idle
+
+    def __init__(self, pulses):
+        self.edges = []
+        self.start_at = time.monotonic() + LEAD_IN
+        at = self.start_at
+
+        for pulse in pulses:
+            self.edges.append(at)
+            at += pulse / 1000000
+
+        self.edges.append(at)
+
+    def input(self, pin):
+        now = time.monotonic()
+        level = 1
+
+        for edge in self.edges:
+            if edge > now:
+                break
+
+            level ^= 1
+
+        return level
+
+def legacy_read_signal(GPIO):
+    # The former helper.read_signal loop
+    value = 1
+    while value:
+        value = GPIO.input(12)
+
+    startTime = datetime.now()
+    command = []
+    numOnes = 0
+    previousVal = 0
+
+    while True:
+        if value != previousVal:
+            now = datetime.now()
+            pulseLength = now - startTime
+            startTime = now
+            command.append((previousVal, pulseLength.microseconds))
+
+        if value:
+            numOnes = numOnes + 1
+        else:
+            numOnes = 0
+
+        if numOnes > 80000:
+            break
+
+        previousVal = value
+        value = GPIO.input(12)
+
+    return [pulse for (val, pulse) in command]
+
+def error(pulses, expected):
+    if len(pulses) != len(expected):
+        return 'got %d of %d pulses' % (len(pulses), len(expected))
+
+    return 'max error %d us' % max(abs(a - b) for a, b in zip(pulses, expected))
+
+def measure(name, capture, expected):
+    started_at = time.monotonic()
+    cpu_at = time.process_time()
+    pulses = capture()
+    elapsed = time.monotonic() - started_at
+    cpu = time.process_time() - cpu_at
+
+    print('%-8s %7.1f ms wall %7.1f ms cpu %5.1f%% core, %s' % (
+        name, elapsed * 1000, cpu * 1000, cpu / elapsed * 100, error(pulses, expected)))
+
+def averaging(frames, trials = 200):
+    # Receiver jitter of +-15% per pulse, the template should get closer to the sent signal
+    rng = random.Random(frames)
+    error = 0
+    sizes = [0, 0]
+
+    for i in range(trials):
+        captured = [[int(pulse * rng.uniform(0.85, 1.15)) for pulse in SIGNAL] for j in range(frames)]
+        template, variance, used = merge_frames(captured)
+        error += sum(abs(a - b) for a, b in zip(template, SIGNAL)) / len(SIGNAL)
+        signal = ' '.join(str(pulse) for pulse in template)
+        sizes[0] += len(helper.compress_signal(signal, DEFAULT_THRESHOLDS))
+        sizes[1] += len(helper.compress_signal(signal))
+
+    print('%d frames  mean error %5.1f us, message %5.1f B fixed thresholds %5.1f B learned' % (
+        frames, error / trials, sizes[0] / trials, sizes[1] / trials))
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+
+    # The fake GPIO is slower than RPi.GPIO, the legacy loop is timed on it as it is
+    print('NEC frame')
+    measure('legacy', lambda: legacy_read_signal(FakeGPIO(SIGNAL)), SIGNAL)
+    measure('edges', lambda: IrCapture(ReplayBackend(SIGNAL, realtime=True, lead_in=LEAD_IN)).capture(), SIGNAL)
+
+    # A 1.2 s pulse wraps around with datetime.microseconds
+    long_signal = SIGNAL[:4] + [1200000] + SIGNAL[:4]
+    print('1.2 s pulse')
+    measure('legacy', lambda: legacy_read_signal(FakeGPIO(long_signal)), long_signal)
+    measure('edges', lambda: IrCapture(ReplayBackend(long_signal, realtime=True, lead_in=LEAD_IN), gap_timeout=2).capture(), long_signal)
+
+    frames = 2000
+    started_at = time.perf_counter()
+
+    for i in range(frames):
+        IrCapture(ReplayBackend(SIGNAL)).capture()
+
+    print('replay   %7.1f us per frame' % ((time.perf_counter() - started_at) / frames * 1000000))
+
+    for frames in [1, 3, 5]:
+        averaging(frames)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Compares stop-and-wait with windowed chunk transmission against a simulated Arduino
+# Run from the repository root: python3 -m bench.chunks
+import threading, queue, time
+from app.drivers import ArduinoQueueItem, SerialReader, SerialEmulator
+
+BAUDRATE = 500000
+# One way USB serial latency and Arduino time per chunk
+LATENCY = 0.002
+PROCESSING = 0.0005
+MESSAGE_SIZE = 600
+PRESSES = 50
+
+class FakeArduino(SerialEmulator):
+
+    def __init__(self, credits):
+        SerialEmulator.__init__(self, None)
+        self.credits = credits
+        self.busy_until = 0
+        self.deliveries = queue.Queue()
+        self.port = '/dev/fake'
+        self.timeout = 0.5
+        deliverer = threading.Thread(target=self.deliver)
+        deliverer.setDaemon(True)
+        deliverer.start()
+
+    def write(self, data):
+        # Chunks are handled one after another, acks travel back over USB
+        arrival = time.perf_counter() + LATENCY + len(data) * 10 / BAUDRATE
+        self.busy_until = max(arrival, self.busy_until) + PROCESSING
+
+        if data[-1] == 10:
+            response = b':success:\n'
+        else:
+            response = (':next %d:\n' % self.credits).encode()
+
+        self.deliveries.put((self.busy_until + LATENCY, response))
+
+    def flush(self):
+        pass
+
+    def deliver(self):
+        while True:
+            deliver_at, response = self.deliveries.get()
+            delay = deliver_at - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            self.addToBuffer(response)
+
+def measure(window):
+    ser = FakeArduino(window)
+    sr = SerialReader(None, ser, None)
+    sr.setDaemon(True)
+    sr.start()
+
+    message = b'\x01' + b'1a2b' * ((MESSAGE_SIZE - 2) // 4) + b'\n'
+    chunks = (len(message) + 63) // 64
+
+    # The first ack advertises the credits
+    ArduinoQueueItem(message, 2).run(sr, ser, 1)
+
+    start_at = time.perf_counter()
+
+    for i in range(PRESSES):
+        ArduinoQueueItem(message, 2).run(sr, ser, min(window, sr.credits))
+
+    elapsed = time.perf_counter() - start_at
+    sr.stop()
+
+    print('window %d: %d bytes in %d chunks, %6.2f ms per press, %8.0f bytes/s' % (
+        window, len(message), chunks, elapsed / PRESSES * 1000, len(message) * PRESSES / elapsed))
+
+if __name__ == '__main__':
+    for window in [1, 2, 4, 8]:
+        measure(window)
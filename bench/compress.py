@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# Checks the IR compressor against the former loop and times it over a corpus of remotes
+# Run from the repository root: python3 -m bench.compress
+import random, timeit
+from app import helper, ircompress
+from app.irdecode import IrCode, encode_code
+from app.ircompress import DEFAULT_THRESHOLDS, learn_thresholds
+
+ROUNDS = 2000
+FUZZ = 5000
+
+SAMPLE = "8851 4435 565 1644 591 512 568 565 566 540 567 1642 568 565 567 1644 592 539 540 565 592 1623 592 1647 594 511 589 1650 562 1646 593 1643 594 513 595 511 590 516 565 569 592 510 595 1615 570 564 592 514 593 513 566 565 541 567 591 515 592 513 567 565 541 565 592 515 565 565 541 565 591 517 564 541 590 515 591 541 591 1619 568 564 538 568 566 539 591 513 592 543 561 545 589 516 593 512 565 567 565 539 566 1644 565 567 593 1618 593 1643 594 515 590 514 565 1675 589 514 593"
+
+def legacy_compress_signal(signal):
+    # The former helper.compress_signal
+    nec_protocol = 0
+    pre_data = []
+    data = []
+
+    zero = []
+    one = []
+    zero_bit = 0
+    one_bit = 0
+    compressed = ''
+
+    for value in signal.split(' '):
+        if nec_protocol < 2:
+            data.append(value)
+            nec_protocol += 1
+            continue
+
+        x = int(value)
+
+        if x <= 1000:
+            zero.append(x)
+            if one_bit > 0:
+                compressed += "%db" % one_bit
+                one_bit = 0
+                zero_bit = 1
+            else:
+                zero_bit += 1
+
+        elif x < 1800:
+            one.append(x)
+            if zero_bit > 0:
+                compressed += "%da" % zero_bit
+                zero_bit = 0
+                one_bit = 1
+            else:
+                one_bit += 1
+        else:
+            if zero_bit > 0:
+                compressed += "%da" % zero_bit
+                zero_bit = 0
+            if one_bit > 0:
+                compressed += "%db" % one_bit
+                one_bit = 0
+            if compressed:
+                data.append("[%s]" % compressed)
+                compressed = ''
+            if x > 65000:
+                value = '65000'
+            data.append(value)
+
+    if zero_bit > 0:
+        compressed += "%da" % zero_bit
+    if one_bit > 0:
+        compressed += "%db" % one_bit
+    if compressed:
+        data.append("[%s]" % compressed)
+
+    pre_data.append(str(round(sum(zero)/len(zero))))
+    pre_data.append(str(round(sum(one)/len(one))))
+
+    message = ' '.join(pre_data + data)
+    return '%s\n' % message
+
+def pulse_distance(rng, header, mark, zero, one, bits, gap = None, frames = 1):
+    # Synthetic remote: header, then a mark and a space per bit, recorded with jitter
+    jitter = lambda value: int(value * rng.uniform(0.92, 1.08))
+    pulses = []
+
+    for frame in range(frames):
+        if frame > 0:
+            pulses.append(jitter(gap))
+
+        pulses.extend(jitter(value) for value in header)
+
+        for i in range(bits):
+            pulses.append(jitter(mark))
+            pulses.append(jitter(rng.choice([zero, one])))
+
+        pulses.append(jitter(mark))
+
+    return ' '.join(str(pulse) for pulse in pulses)
+
+def sony(rng, bits = 12):
+    jitter = lambda value: int(value * rng.uniform(0.92, 1.08))
+    pulses = [jitter(2400), jitter(600)]
+
+    for i in range(bits):
+        pulses.append(jitter(rng.choice([600, 1200])))
+        pulses.append(jitter(600))
+
+    return ' '.join(str(pulse) for pulse in pulses[:-1])
+
+def corpus():
+    rng = random.Random(3)
+
+    return [
+        ('nec sample', SAMPLE),
+        ('nec', pulse_distance(rng, [9000, 4500], 560, 560, 1690, 32)),
+        ('samsung', pulse_distance(rng, [4500, 4500], 560, 560, 1690, 32)),
+        ('sony', sony(rng)),
+        ('panasonic', pulse_distance(rng, [3500, 1750], 432, 432, 1296, 48, 10000, 2)),
+        ('ac 3 frames', pulse_distance(rng, [3400, 1750], 430, 420, 1300, 152, 30000, 3)),
+        # A held key, the 2250 us repeat spaces have to stay raw
+        ('nec repeats', ' '.join(str(pulse) for pulse in encode_code(IrCode('nec', 0x20, 0xdf, 2)))),
+    ]
+
+def random_signal(rng):
+    pulses = [rng.randint(1, 70000), rng.randint(1, 70000)]
+
+    for i in range(rng.randint(2, 200)):
+        pulses.append(rng.choice([rng.randint(1, 2500), rng.randint(990, 1010), rng.randint(1790, 1810), rng.randint(60000, 70000)]))
+
+    return ' '.join(str(pulse) for pulse in pulses)
+
+def fuzz():
+    rng = random.Random(11)
+    checked = 0
+
+    for i in range(FUZZ):
+        signal = random_signal(rng)
+
+        try:
+            expected = legacy_compress_signal(signal)
+        except ZeroDivisionError:
+            continue
+
+        assert helper.compress_signal(signal, DEFAULT_THRESHOLDS) == expected, signal
+        checked += 1
+
+    return checked
+
+def timed(signal):
+    return min(timeit.repeat(lambda: helper.compress_signal(signal), number=ROUNDS, repeat=7)) / ROUNDS * 1000000
+
+if __name__ == '__main__':
+    numpy = ircompress.np
+    cutoff = ircompress.NUMPY_MIN_PULSES
+
+    # numpy is forced on every frame length to check it against the plain Python path
+    for name, module, min_pulses in [('numpy', numpy, 0), ('python', None, cutoff)]:
+        if name == 'numpy' and numpy is None:
+            print('numpy is not installed')
+            continue
+
+        ircompress.np = module
+        ircompress.NUMPY_MIN_PULSES = min_pulses
+        print('%s: %d random signals byte-identical with forced thresholds' % (name, fuzz()))
+
+    for name, signal in corpus():
+        pulses = [int(pulse) for pulse in signal.split(' ')[2:]]
+        ircompress.np = None
+        ircompress.NUMPY_MIN_PULSES = cutoff
+        learned = helper.compress_signal(signal)
+        python = timed(signal)
+        ircompress.np = numpy
+        default = timed(signal)
+
+        if numpy is not None:
+            ircompress.NUMPY_MIN_PULSES = 0
+            assert helper.compress_signal(signal) == learned, name
+            forced = '%7.1f us' % timed(signal)
+            ircompress.NUMPY_MIN_PULSES = cutoff
+        else:
+            forced = '    n/a   '
+
+        legacy = min(timeit.repeat(lambda: legacy_compress_signal(signal), number=ROUNDS, repeat=7)) / ROUNDS * 1000000
+        # Jittered ones above 1800 us end up as raw pulses with the fixed thresholds
+        print('%-12s %4d pulses thresholds %-13s legacy %7.1f us default %7.1f us numpy %s python %7.1f us, %4d bytes, legacy %4d bytes' % (
+            name, len(pulses) + 2, learn_thresholds(pulses), legacy, default, forced, python, len(learned), len(legacy_compress_signal(signal))))
+
+    repeats = dict(corpus())['nec repeats']
+    assert helper.compress_signal(repeats).count(' 2250 ') == 2, 'NEC repeat space lost'
+    print('nec repeats  %s' % helper.compress_signal(repeats).strip())
+
+    # A noise spike must not take the place of the zeros
+    noisy = SAMPLE.split(' ')
+    noisy[10] = '250'
+    print('noise spike  thresholds %s, %d bytes' % (learn_thresholds([int(pulse) for pulse in noisy[2:]]), len(helper.compress_signal(' '.join(noisy)))))
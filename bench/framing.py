@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Compares the FrameReader with the former recv(1) loop of RpiNode.run
+# Run from the repository root: python3 -m bench.framing
+import socket, threading, time, json
+from app.stream import FrameReader
+
+MESSAGES = 20000
+
+def feed(sock, payload):
+    sock.sendall(payload)
+    sock.close()
+
+def byte_loop(sock):
+    count = 0
+    message_buff = ''
+
+    while True:
+        data = sock.recv(1)
+
+        if not data:
+            break
+
+        udata = data.decode()
+
+        if udata != "\n":
+            message_buff += udata
+            continue
+
+        count += 1
+        message_buff = ''
+
+    return count
+
+def frame_reader(sock):
+    count = 0
+
+    for message in FrameReader(sock).frames():
+        message.decode('utf-8', 'replace')
+        count += 1
+
+    return count
+
+def measure(name, reader, payload):
+    rsock, wsock = socket.socketpair()
+    writer = threading.Thread(target=feed, args=(wsock, payload))
+    writer.start()
+
+    start_at = time.perf_counter()
+    count = reader(rsock)
+    elapsed = time.perf_counter() - start_at
+
+    writer.join()
+    rsock.close()
+    print('%-14s %7d messages %8.3f s %12.0f msg/s' % (name, count, elapsed, count / elapsed))
+
+if __name__ == '__main__':
+    message = json.dumps({'event': 'pushButton', 'button_id': 42, 'user_id': 1})
+    payload = ('%s\n' % message).encode() * MESSAGES
+
+    measure('recv(1) loop', byte_loop, payload)
+    measure('FrameReader', frame_reader, payload)
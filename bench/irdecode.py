@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Compares the size of compressed IR signals with protocol codes and checks the decoder round trip
+# Run from the repository root: python3 -m bench.irdecode
+import random, timeit, logging
+from app import helper
+from app.irdecode import IrCode, decode_signal, encode_code, format_code
+
+# ArduinoQueueItem chunk and nRF24 payload sizes
+CHUNK = 64
+RADIO_PAYLOAD = 32
+ROUNDS = 2000
+
+CODES = [
+    IrCode('nec', 0x04, 0x08, 0),
+    IrCode('nec', 0x20, 0xdf, 2),
+    IrCode('necx', 0x7f00, 0x1c, 0),
+    IrCode('sony12', 0x01, 0x15, 2),
+    IrCode('sony20', 0x1a, 0x3b, 2),
+    IrCode('rc5', 0x00, 0x0c, 0),
+    IrCode('rc6', 0x00, 0x0c, 0),
+]
+
+def record(rng, pulses):
+    # Receivers are off by a few percent
+    return ' '.join(str(int(pulse * rng.uniform(0.9, 1.1))) for pulse in pulses)
+
+def packets(size, payload):
+    return (size + payload - 1) // payload
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(5)
+
+    for code in CODES:
+        signal = record(rng, encode_code(code))
+        assert decode_signal([int(pulse) for pulse in signal.split(' ')]) == code, code
+
+        compressed = helper.compress_signal(signal)
+        packed = helper.pack_signal(signal)
+        decode_time = min(timeit.repeat(lambda: helper.pack_signal(signal), number=ROUNDS, repeat=3)) / ROUNDS * 1000000
+
+        print('%-18s compressed %4d B %d chunks %2d packets | code %2d B %d chunk %d packet | pack %5.1f us' % (
+            format_code(code), len(compressed), packets(len(compressed), CHUNK), packets(len(compressed), RADIO_PAYLOAD),
+            len(packed), packets(len(packed), CHUNK), packets(len(packed), RADIO_PAYLOAD), decode_time))
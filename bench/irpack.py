@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Compares text and bit packed IR signals: size, serial chunks and estimated transfer time
+# Run from the repository root: python3 -m bench.irpack
+import random, timeit
+from app import helper
+from app.irpack import encode_packed, decode_packed, RESERVED, ESCAPE
+from bench.compress import corpus
+from bench.chunks import BAUDRATE, LATENCY, PROCESSING
+
+CHUNK = 64
+ROUNDS = 2000
+FUZZ = 3000
+
+def transfer_ms(size):
+    # Stop-and-wait: every chunk waits for its ack over USB
+    chunks = (size + CHUNK - 1) // CHUNK
+    return (size * 10 / BAUDRATE + chunks * (2 * LATENCY + PROCESSING)) * 1000
+
+def fuzz():
+    rng = random.Random(13)
+
+    for i in range(FUZZ):
+        signal = ' '.join(str(rng.choice([rng.randint(300, 2000), rng.randint(1, 140000)])) for i in range(rng.randint(4, 300)))
+
+        try:
+            compressed = helper.compress_signal(signal)
+        except ZeroDivisionError:
+            continue
+
+        packed = encode_packed(compressed)
+        raw = packed.encode('latin-1')
+        assert decode_packed(packed) == compressed.rstrip('\n'), signal
+        assert not any(byte in raw for byte in RESERVED if byte != ESCAPE), signal
+
+    print('fuzz: %d random signals round trip, no new line or 0x17 in the packed bytes' % FUZZ)
+
+if __name__ == '__main__':
+    fuzz()
+
+    for name, signal in corpus():
+        text = helper.compress_signal(signal)
+        packed = '%s\n' % encode_packed(text)
+        # One pipe byte in front of every frame
+        text_size = len(text.encode()) + 1
+        packed_size = len(packed.encode('latin-1')) + 1
+        encode_time = min(timeit.repeat(lambda: encode_packed(text), number=ROUNDS, repeat=3)) / ROUNDS * 1000000
+
+        print('%-12s text %4d B %2d chunks %5.1f ms | packed %4d B %2d chunks %5.1f ms | ratio %.2f, encode %6.1f us' % (
+            name, text_size, (text_size + CHUNK - 1) // CHUNK, transfer_ms(text_size),
+            packed_size, (packed_size + CHUNK - 1) // CHUNK, transfer_ms(packed_size),
+            text_size / packed_size, encode_time))
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Fuzzes the bytes radio frame parser against the former str based one and times both
+# Run from the repository root: python3 -m bench.parser
+import random, timeit, math, logging
+from app.drivers import SerialPackage, Package, typed_values
+
+ROUNDS = 20000
+FRAMES = 50000
+
+class LegacySerialPackage():
+
+    def __init__(self, package, serial_port):
+        self.serial_port = serial_port
+        self.package = package.strip()
+        self.is_last = self.package[-1].encode() == b"\x17"
+
+    def getRadioPipe(self):
+        return self.package[:1]
+
+    def getPackageNumber(self):
+        if self.package[1:2].isdigit():
+            return int(self.package[1:2])
+        return None
+
+    def getPayload(self):
+        return self.package[2:]
+
+class LegacyPackage():
+
+    def __init__(self, sp):
+        self.complete = False
+        self.package_number = 1
+        self.payload = sp.getPayload()
+        self.type = None
+        self.message = ''
+        self.isComplete(sp)
+
+    def append(self, sp):
+        if sp.getPackageNumber() == self.package_number:
+            self.package_number += 1
+            self.payload += sp.getPayload()
+            self.isComplete(sp)
+
+    def isComplete(self, sp):
+        if sp.is_last:
+            self.complete = True
+
+            try:
+                message = dict(s.split(' ') for s in self.payload[:-1].split(','))
+            except Exception as e:
+                return
+
+            if 'tp' in message and message['tp'] in ['ev', 'rs', 'rq']:
+                self.type = message['tp']
+                del message['tp']
+                self.message = message
+
+def legacy_line(line):
+    # The former serial loop decoded every line before parsing
+    return LegacySerialPackage(line.decode('ascii', 'replace'), 'fuzz')
+
+def reassemble(serial_package, package, lines):
+    sp = serial_package(lines[0], 'fuzz')
+
+    if sp.getPackageNumber() != 0:
+        return None
+
+    result = package(sp)
+
+    for line in lines[1:]:
+        result.append(serial_package(line, 'fuzz'))
+
+    return result
+
+def normalize(message):
+    # typed_values returns finite numbers, the legacy parser strings
+    if not isinstance(message, dict):
+        return message
+
+    normalized = {}
+
+    for key in message:
+        value = message[key]
+
+        if isinstance(value, str):
+            try:
+                if math.isfinite(float(value)):
+                    value = float(value)
+            except ValueError:
+                pass
+
+        normalized[key] = float(value) if isinstance(value, int) else value
+
+    return normalized
+
+def random_payload(rng):
+    fields = ['tp %s' % rng.choice(['ev', 'rq', 'rs', 'xx'])]
+
+    for i in range(rng.randint(0, 6)):
+        key = rng.choice(['t', 'h', 'p', 'b', 'id'])
+        value = rng.choice(['%.2f' % rng.uniform(-50, 1100), str(rng.randint(0, 9999)), 'on', '', '+inf', 'nan'])
+        fields.append('%s %s' % (key, value))
+
+    payload = ','.join(fields)
+
+    if rng.random() < 0.1:
+        # Break the syntax now and then
+        payload = payload.replace(' ', rng.choice(['', '  ', ',']), 1)
+
+    return payload
+
+def random_lines(rng):
+    # str.strip() of the legacy parser also eats pipes that look like whitespace
+    pipe = rng.choice([chr(i) for i in range(1, 120) if not chr(i).isspace()])
+    payload = random_payload(rng) + '\x17'
+    size = rng.randint(4, 32)
+    parts = [payload[i:i+size] for i in range(0, len(payload), size)]
+
+    if rng.random() < 0.05:
+        rng.shuffle(parts)
+
+    return ['%s%d%s\r\n' % (pipe, number % 10, part) for number, part in enumerate(parts)]
+
+def fuzz():
+    rng = random.Random(7)
+
+    for i in range(ROUNDS):
+        lines = random_lines(rng)
+        legacy = reassemble(LegacySerialPackage, LegacyPackage, lines)
+        current = reassemble(SerialPackage, Package, [line.encode('latin-1') for line in lines])
+
+        if legacy is None:
+            assert current is None, lines
+            continue
+
+        assert legacy.complete == current.complete, lines
+        assert legacy.type == current.getType(), lines
+        assert legacy.message == current.getMessage(), lines
+
+        if legacy.message:
+            assert normalize(legacy.message) == normalize(typed_values(current.getMessage())), lines
+
+    print('fuzz: %d random frames agree' % ROUNDS)
+
+def legacy_typed(lines):
+    # The legacy result converted like typed_values does
+    package = reassemble(lambda line, port: legacy_line(line), LegacyPackage, lines)
+    message = {}
+
+    for key in package.message:
+        try:
+            message[key] = float(package.message[key])
+        except ValueError:
+            message[key] = package.message[key]
+            continue
+
+        if not math.isfinite(message[key]):
+            message[key] = package.message[key]
+
+    return message
+
+def measure(parsers, rounds = 15):
+    # Best of interleaved runs, the Pi is rarely idle and slow phases hit every parser alike
+    best = dict((name, None) for name, parse in parsers)
+
+    for i in range(rounds):
+        for name, parse in parsers:
+            elapsed = timeit.timeit(parse, number=FRAMES // 10)
+
+            if best[name] is None or elapsed < best[name]:
+                best[name] = elapsed
+
+    for name, parse in parsers:
+        print('%-13s %6.2f us per package' % (name, best[name] / (FRAMES // 10) * 1000000))
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    fuzz()
+
+    lines = [b'20tp ev,t 21.30,h 50.10,p 1032\n', b'21.55,b 4.01\x17\n']
+    measure([
+        ('legacy', lambda: reassemble(lambda line, port: legacy_line(line), LegacyPackage, lines)),
+        ('bytes', lambda: reassemble(SerialPackage, Package, lines)),
+        ('legacy+typed', lambda: legacy_typed(lines)),
+        ('bytes+typed', lambda: typed_values(reassemble(SerialPackage, Package, lines).getMessage())),
+    ])
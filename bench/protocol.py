@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Compares newline JSON with the binary framing for the hot message types
+# Run from the repository root: python3 -m bench.protocol
+import json, timeit
+from app import helper
+from app.protocol import encode_message, decode_message, HEADER
+
+ROUNDS = 20000
+
+def json_encode(message):
+    return ("%s\n" % json.dumps(message)).encode()
+
+def json_decode(frame):
+    return json.loads(frame.decode('utf-8', 'replace'))
+
+def binary_decode(frame):
+    message_type, length = HEADER.unpack_from(frame, 0)
+    return decode_message(message_type, frame[HEADER.size:])
+
+def measure(name, message):
+    json_frame = json_encode(message)
+    binary_frame = encode_message(message)
+    assert binary_decode(binary_frame) == json_decode(json_frame)
+
+    results = []
+
+    for encode, decode, frame in [(json_encode, json_decode, json_frame), (encode_message, binary_decode, binary_frame)]:
+        encode_time = min(timeit.repeat(lambda: encode(message), number=ROUNDS, repeat=3)) / ROUNDS
+        decode_time = min(timeit.repeat(lambda: decode(frame), number=ROUNDS, repeat=3)) / ROUNDS
+        results.append((len(frame), encode_time * 1000000, decode_time * 1000000))
+
+    print('%-12s json %4d B enc %5.2f us dec %5.2f us | binary %4d B enc %5.2f us dec %5.2f us' % (
+        (name,) + results[0] + results[1]))
+
+if __name__ == '__main__':
+    event = {
+        'type': 'event',
+        'result': 'success',
+        'port': '/dev/ttyUSB0',
+        'message': {'t': 21.3, 'h': 50.1, 'p': 1032.55, 'b': 4.01},
+        'radio_pipe': 2
+    }
+    ir_signal = helper.compress_signal("8851 4435 565 1644 591 512 568 565 566 540 567 1642 568 565 567 1644 592 539 540 565 592 1623 592 1647 594 511 589 1650 562 1646 593 1643 594 513 595 511 590 516 565 569 592 510 595 1615 570 564 592 514 593 513 566 565 541 567 591 515 592 513 567 565 541 565 592 515 565 565 541 565 591 517 564 541 590 515 591 541 591 1619 568 564 538 568 566 539 591 513 592 543 561 545 589 516 593 512 565 567 565 539 566 1644 565 567 593 1618 593 1643 594 515 590 514 565 1675 589 514 593")
+
+    measure('pushButton', {'event': 'pushButton', 'button_id': 1042, 'user_id': 7})
+    measure('event', event)
+    measure('events x16', {'type': 'events', 'result': 'success', 'events': [event] * 16})
+    measure('ir', {'type': 'ir', 'result': 'success', 'ir_signal': ir_signal})
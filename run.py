@@ -26,5 +26,9 @@ else:
 
     app.emulation = False
 
+# Handshake features the server supports, e.g. APP_FEATURES=batch,bin,ir_frames,typed
+if 'APP_FEATURES' in os.environ:
+    app.features = [feature for feature in os.environ['APP_FEATURES'].split(',') if feature]
+
 if __name__ == '__main__':
     app.run(debug=debug)